@@ -0,0 +1,82 @@
+"""Micro-benchmark for the URL extractor's HTML analysis over saved pages.
+
+Compares the previous approach, three BeautifulSoup parses for headings, images
+and JSON-LD plus a Trafilatura parse for metadata, with the single lxml parse in
+lib.extractors.analysis whose tree is reused for metadata.
+
+Usage:
+    python benchmarks/html_analysis.py path/to/pages/*.html [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'seodp'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from trafilatura import extract  # noqa: E402
+
+from lib.extractors.analysis import analyze_html  # noqa: E402
+
+
+def baseline(raw_html: str):
+    soup = BeautifulSoup(raw_html, 'html.parser')
+    headings = {'h1': 0, 'h2': 0, 'h3': 0, 'h4': 0, 'h5': 0, 'h6': 0}
+    for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
+        headings[tag.name] += 1
+    images = len(BeautifulSoup(raw_html, 'html.parser').find_all('img'))
+    schema = []
+    for tag in BeautifulSoup(raw_html, 'html.parser').find_all('script', type='application/ld+json'):
+        try:
+            schema.append(json.loads(tag.string))
+        except Exception:
+            pass
+    metadata = extract(raw_html, output_format="json", include_comments=False, with_metadata=True)
+    return headings, images, schema, metadata
+
+
+def single_pass(raw_html: str):
+    page = analyze_html(raw_html)
+    metadata = extract(page.tree, output_format="json", include_comments=False, with_metadata=True)
+    return page.heading_structure, page.image_count, page.schema_markup, metadata
+
+
+def time_it(func, pages, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for raw_html in pages:
+            func(raw_html)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark HTML analysis over saved pages')
+    parser.add_argument('pages', nargs='+', help='Saved HTML files')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per approach; the best is reported')
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.pages:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            pages.append(f.read())
+    total_mb = sum(len(page) for page in pages) / 1e6
+
+    for raw_html, path in zip(pages, args.pages):
+        old, new = baseline(raw_html), single_pass(raw_html)
+        if old[:3] != new[:3]:
+            print(f"WARNING: results differ for {path}")
+
+    old_time = time_it(baseline, pages, args.repeat)
+    new_time = time_it(single_pass, pages, args.repeat)
+    print(f"{len(pages)} pages, {total_mb:.1f} MB")
+    print(f"  BeautifulSoup x3 + Trafilatura: {old_time:.3f}s")
+    print(f"  single lxml pass:               {new_time:.3f}s ({old_time / new_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Check that importing the CLI stays within an import-time budget.
+
+Runs `python -X importtime -c "import main"` from src/seodp, reports the slowest
+imports and fails if the total exceeds the budget or if a heavy API dependency
+is imported before a command needs it.
+
+Usage:
+    python benchmarks/import_time.py [--budget 1.0] [--top 15]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'seodp')
+
+# Modules that must only be imported once a command actually uses them.
+DEFERRED_MODULES = [
+    'google.generativeai',
+    'googleapiclient',
+    'google.analytics.data_v1beta',
+    'trafilatura',
+    'bs4',
+    'scrapingbee',
+    'apscheduler',
+]
+
+
+def measure_imports():
+    """Return [(cumulative_us, module)] for every module imported by `import main`."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"Importing main failed:\n{result.stderr}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        # Drop the separator space; any remaining indentation marks a nested import.
+        timings.append((int(cumulative), module[1:].rstrip()))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time budget check for the SEO Data Platform CLI')
+    parser.add_argument('--budget', type=float, default=1.0, help='Maximum import time of main in seconds')
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to list')
+    args = parser.parse_args()
+
+    timings = measure_imports()
+    # Top-level imports have no leading indentation, so their cumulative times add up to the total.
+    total = sum(cumulative for cumulative, module in timings if not module.startswith(' ')) / 1e6
+
+    print("Slowest imports (cumulative):")
+    for cumulative, module in sorted(timings, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1e6:8.3f}s  {module.strip()}")
+    print(f"Total: {total:.3f}s (budget {args.budget:.3f}s)")
+
+    imported = {module.strip() for _, module in timings}
+    eager = [name for name in DEFERRED_MODULES if name in imported]
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+    if total > args.budget:
+        print("FAIL: import time over budget")
+    sys.exit(1 if eager or total > args.budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""Prompt size benchmark for LLM insight generation.
+
+Compares the data block of the original insight prompt (both periods as
+indented JSON) with the compacted, delta-oriented block from
+lib.manager.prompt.PromptCompactor, for one or more saved --url_test results.
+Token counts are estimates at four characters per token.
+
+Usage:
+    python benchmarks/prompt_tokens.py [url_test.json ...] [--budget 6000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'seodp'))
+
+from lib.manager.prompt import PromptCompactor, dumps, estimate_tokens  # noqa: E402
+
+DEFAULT_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'url_test.json')
+
+
+def baseline(current_data, prior_data) -> str:
+    return f"""
+        Current Data:
+        {json.dumps(current_data, indent=2)}
+
+        Prior Data:
+        {json.dumps(prior_data, indent=2)}
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark insight prompt size')
+    parser.add_argument('results', nargs='*', default=[DEFAULT_INPUT], help='Saved --url_test output files')
+    parser.add_argument('--budget', type=int, default=6000, help='Token budget for the compacted data')
+    parser.add_argument('--content-chars', type=int, default=3000, help='Maximum characters of content diff')
+    args = parser.parse_args()
+
+    compactor = PromptCompactor(args.budget, args.content_chars)
+    total_before = total_after = 0
+    for path in args.results:
+        with open(path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+
+        before = estimate_tokens(baseline(result['current_data'], result['prior_data']))
+        started = time.perf_counter()
+        after = estimate_tokens(dumps(compactor.compact(result['current_data'], result['prior_data'])))
+        elapsed = time.perf_counter() - started
+        total_before += before
+        total_after += after
+        print(f"{result.get('url', path)}: {before} -> {after} tokens ({before / after:.1f}x smaller, compacted in {elapsed * 1000:.1f} ms)")
+
+    if len(args.results) > 1:
+        print(f"total: {total_before} -> {total_after} tokens ({total_before / total_after:.1f}x smaller)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Micro-benchmark for the text normalizer used on extracted page content.
+
+Compares the previous per-character cleanup in URLExtractor._format_content
+(BeautifulSoup get_text, a generator over every character and two splits for
+whitespace and word count) with lib.extractors.text.normalize_text and its
+streaming variant.
+
+Usage:
+    python benchmarks/text_normalizer.py path/to/content/*.html [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'seodp'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from lib.extractors.text import iter_normalized_words, normalize_text  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+def baseline(content: str):
+    content = BeautifulSoup(content, 'html.parser').get_text()
+    content = ''.join(e for e in content if e.isalnum() or e.isspace())
+    content = ' '.join(content.split())
+    return content, len(content.split())
+
+
+def streaming(content: str):
+    chunks = (content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE))
+    words = list(iter_normalized_words(chunks))
+    return ' '.join(words), len(words)
+
+
+def time_it(func, documents, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for content in documents:
+            func(content)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark content normalization')
+    parser.add_argument('documents', nargs='+', help='Saved content HTML files, e.g. Readability output')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per approach; the best is reported')
+    args = parser.parse_args()
+
+    documents = []
+    for path in args.documents:
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            documents.append(f.read())
+
+    for content, path in zip(documents, args.documents):
+        if baseline(content)[1] != normalize_text(content).word_count:
+            print(f"NOTE: word counts differ for {path}")
+
+    old_time = time_it(baseline, documents, args.repeat)
+    new_time = time_it(normalize_text, documents, args.repeat)
+    stream_time = time_it(streaming, documents, args.repeat)
+    print(f"{len(documents)} documents, {sum(map(len, documents)) / 1e6:.1f} MB")
+    print(f"  per-character loop: {old_time:.3f}s")
+    print(f"  normalize_text:     {new_time:.3f}s ({old_time / new_time:.1f}x)")
+    print(f"  streaming:          {stream_time:.3f}s ({old_time / stream_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
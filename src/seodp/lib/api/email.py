@@ -14,6 +14,7 @@ from settings import Config
 class EmailHandler:
     def __init__(self, config: Config):
         self.config = config
+        config.api.require('mailtrap_login', 'mailtrap_password', 'mailtrap_sender_email', 'recipient_email')
         self.smtp_server = "live.smtp.mailtrap.io"
         self.port = 587
         self.login = config.api.mailtrap_login
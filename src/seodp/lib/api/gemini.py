@@ -1,25 +1,68 @@
 """Gemini API client"""
 
-from typing import Optional, Any, Dict
+import threading
+import time
+from typing import Optional, Any, Callable, Dict, Sequence, Union
 import google.generativeai as genai
 from google.generativeai import GenerativeModel, GenerationConfig
 from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
 from loguru import logger
-from lib.exceptions import GeminiAPIError
+from lib.api.telemetry import LLMTelemetry, LLMUsage
+from lib.cache import DiskCache
+from lib.exceptions import GeminiAPIError, TokenBudgetExceeded
 
 from settings import Config
 
 
 class GeminiAPIClient:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, cache: Optional[DiskCache] = None, telemetry: Optional[LLMTelemetry] = None):
         self.config = config
+        self.cache = cache
+        self.telemetry = telemetry or LLMTelemetry()
+        config.api.require('gemini_api_key')
         genai.configure(api_key=config.api.gemini_api_key)
-        self.model = GenerativeModel(model_name=config.gemini_model)
+        self.model_name = config.gemini_model
+        self.model = GenerativeModel(model_name=self.model_name)
+        self._model_lock = threading.Lock()
+        self._local = threading.local()
+
+    def start_run(self) -> None:
+        """Reset the run's usage and switch back to the configured model."""
+        self.telemetry.reset()
+        with self._model_lock:
+            if self.model_name != self.config.gemini_model:
+                self.model_name = self.config.gemini_model
+                self.model = GenerativeModel(model_name=self.model_name)
 
     def generate_content(self, prompt: str, response_schema: Optional[Dict[str, Any]] = None, 
                          temperature: float = 0.2, top_p: float = 1, top_k: int = 1, 
-                         max_output_tokens: int = 2048) -> str:
-        """Generate content using the Gemini API."""
+                         max_output_tokens: int = 2048, label: Union[str, Sequence[str], None] = None,
+                         validate: Optional[Callable[[str], Any]] = None) -> str:
+        """Generate content using the Gemini API.
+
+        With a cache, responses are stored under a hash of the model, prompt, response
+        schema and generation parameters, and identical requests are answered from it.
+        A response for which `validate` raises ValueError (a truncated JSON response,
+        say) is neither cached nor served from the cache, and the error is raised.
+        Token usage is read from the response and recorded in the telemetry under
+        `label`, or split between several labels for a batched request. Raises TokenBudgetExceeded once the run's token budget is spent,
+        unless a fallback model is configured to continue with.
+        """
+        self._check_budget()
+        model_name, model = self.model_name, self.model
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = DiskCache.make_key(
+                "gemini", model_name, prompt, response_schema,
+                temperature, top_p, top_k, max_output_tokens
+            )
+            cached = self.cache.get(cache_key)
+            if cached is not None and self._is_valid(cached, validate):
+                logger.info("Using cached Gemini response")
+                self.telemetry.record(LLMUsage(cached_calls=1), label)
+                return cached
+
         generation_config = GenerationConfig(
             temperature=temperature,
             top_p=top_p,
@@ -29,27 +72,82 @@ class GeminiAPIClient:
             response_schema=response_schema
         )
 
+        self._local.attempts = 0
+        response = None
+        failed = True
+        started = time.monotonic()
         try:
-            response_text = self._make_api_call(prompt, generation_config)
-            self._log_token_counts(prompt, response_text)
-            return response_text
+            response = self._make_api_call(model, prompt, generation_config)
+            response_text = response.text
+            failed = False
         except RetryError as e:
             logger.error(f"Gemini API call failed after multiple retries: {str(e)}")
             raise GeminiAPIError(f"Gemini API call failed after multiple retries: {str(e)}")
         except Exception as e:
             logger.error(f"Unexpected error during content generation: {str(e)}")
             raise GeminiAPIError(f"Unexpected error during content generation: {str(e)}")
+        finally:
+            self._record_usage(response, time.monotonic() - started, label, failed)
+
+        if validate is not None:
+            validate(response_text)
+        if cache_key is not None:
+            self.cache.set(cache_key, response_text)
+        return response_text
+
+    @staticmethod
+    def _is_valid(response_text: str, validate: Optional[Callable[[str], Any]]) -> bool:
+        if validate is None:
+            return True
+        try:
+            validate(response_text)
+            return True
+        except ValueError:
+            logger.warning("Ignoring invalid cached Gemini response")
+            return False
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def _make_api_call(self, prompt: str, generation_config: GenerationConfig) -> str:
+    def _make_api_call(self, model: GenerativeModel, prompt: str, generation_config: GenerationConfig):
         """Make the API call to Gemini with retry logic."""
-        response = self.model.generate_content(prompt, generation_config=generation_config)
-        return response.text
+        self._local.attempts += 1
+        return model.generate_content(prompt, generation_config=generation_config)
+
+    def _record_usage(self, response, latency: float, label: Union[str, Sequence[str], None], failed: bool = False) -> None:
+        """Record the usage metadata of a response, and the attempts made, in the telemetry.
+
+        A failed call is counted separately from completed ones. It only has tokens
+        if a response came back but couldn't be read, for example when it was blocked.
+        """
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        usage = LLMUsage(
+            calls=0 if failed else 1,
+            failed_calls=1 if failed else 0,
+            retries=max(0, self._local.attempts - 1),
+            prompt_tokens=getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+            response_tokens=getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+            latency=latency,
+        )
+        self.telemetry.record(usage, label)
+        if label and not isinstance(label, str):
+            label = f"a batch of {len(label)} URLs"
+        logger.info(f"Gemini {'failed call' if failed else 'usage'}{f' for {label}' if label else ''}: {usage.prompt_tokens} prompt + "
+                    f"{usage.response_tokens} response tokens in {latency:.1f}s")
+
+    def _check_budget(self) -> None:
+        """Stop, or switch to the fallback model, once the run has used its token budget.
 
-    def _log_token_counts(self, prompt: str, response_text: str) -> None:
-        """Log the token counts for the generated content."""
-        prompt_tokens = self.model.count_tokens(prompt)
-        response_tokens = self.model.count_tokens(response_text)
+        Calls already in flight when the budget runs out still complete, so a run can
+        go over the budget by up to max_concurrency requests.
+        """
+        budget = self.config.llm_run_token_budget
+        if budget is None or self.telemetry.total_tokens < budget:
+            return
 
-        logger.info(f"Prompt tokens: {prompt_tokens}")
-        logger.info(f"Response tokens: {response_tokens}")
\ No newline at end of file
+        fallback = self.config.llm_fallback_model
+        if not fallback:
+            raise TokenBudgetExceeded(f"Run token budget of {budget} tokens exceeded")
+        with self._model_lock:
+            if self.model_name != fallback:
+                logger.warning(f"Run token budget of {budget} tokens exceeded, switching to {fallback}")
+                self.model_name = fallback
+                self.model = GenerativeModel(model_name=fallback)
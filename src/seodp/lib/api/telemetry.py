@@ -0,0 +1,96 @@
+"""Token, latency and cost accounting for LLM calls."""
+
+import threading
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional, Sequence, Union
+
+
+@dataclass
+class LLMUsage:
+    calls: int = 0
+    cached_calls: int = 0
+    # Calls that raised after their retries, or whose response couldn't be read. Not counted in `calls`.
+    failed_calls: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+    latency: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.response_tokens
+
+    def share(self, index: int, count: int) -> 'LLMUsage':
+        """The part of a call made for `count` labels credited to the `index`th: the call
+        itself, its latency, and an even share of its tokens. The shares add up to the tokens."""
+        def split(tokens: int) -> int:
+            return tokens // count + (1 if index < tokens % count else 0)
+        return LLMUsage(self.calls, self.cached_calls, self.failed_calls, self.retries,
+                        split(self.prompt_tokens), split(self.response_tokens), self.latency)
+
+    def add(self, other: 'LLMUsage') -> None:
+        self.calls += other.calls
+        self.cached_calls += other.cached_calls
+        self.failed_calls += other.failed_calls
+        self.retries += other.retries
+        self.prompt_tokens += other.prompt_tokens
+        self.response_tokens += other.response_tokens
+        self.latency += other.latency
+
+
+class LLMTelemetry:
+    """
+    Aggregates LLM usage for the current run, in total and per label (usually a URL).
+
+    Token counts come from the usage metadata of each response, so recording them
+    costs no extra API calls. Thread-safe, since URLs are processed concurrently.
+    """
+
+    def __init__(self, input_cost_per_million: float = 0.0, output_cost_per_million: float = 0.0):
+        self.input_cost_per_million = input_cost_per_million
+        self.output_cost_per_million = output_cost_per_million
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        """Start a new run."""
+        with self._lock:
+            self.total = LLMUsage()
+            self.by_label: Dict[str, LLMUsage] = {}
+
+    def record(self, usage: LLMUsage, label: Union[str, Sequence[str], None] = None) -> None:
+        """Add a call's usage to the total and to its label, or to each of its labels for a
+        call made for several (a batch of URLs), which each get a share of the tokens."""
+        labels = [label] if isinstance(label, str) else list(label or [])
+        with self._lock:
+            self.total.add(usage)
+            for index, name in enumerate(labels):
+                self.by_label.setdefault(name, LLMUsage()).add(usage.share(index, len(labels)))
+
+    @property
+    def total_tokens(self) -> int:
+        with self._lock:
+            return self.total.total_tokens
+
+    def cost(self, usage: LLMUsage) -> float:
+        """Estimated cost in dollars, from the configured per-million-token prices."""
+        return (usage.prompt_tokens * self.input_cost_per_million
+                + usage.response_tokens * self.output_cost_per_million) / 1_000_000
+
+    def summary(self) -> Dict:
+        """Usage and estimated cost for the run, in total and per label."""
+        with self._lock:
+            return {
+                'total': self._describe(self.total),
+                'by_label': {label: self._describe(usage) for label, usage in self.by_label.items()},
+            }
+
+    def _describe(self, usage: LLMUsage) -> Dict:
+        return {**asdict(usage), 'latency': round(usage.latency, 3), 'cost': round(self.cost(usage), 4)}
+
+    def format_summary(self) -> str:
+        with self._lock:
+            total = self.total
+            return (f"{total.calls} calls ({total.cached_calls} cached, {total.failed_calls} failed, {total.retries} retries), "
+                    f"{total.prompt_tokens} prompt + {total.response_tokens} response tokens, "
+                    f"{total.latency:.1f}s, est. ${self.cost(total):.2f}")
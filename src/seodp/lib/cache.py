@@ -0,0 +1,145 @@
+"""Content-addressed on-disk cache for the SEO Data Platform."""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from loguru import logger
+
+
+class DiskCache:
+    """
+    A JSON cache stored as one file per entry, named by the SHA-256 of its key.
+
+    Entries can expire after a TTL or live forever. Reads refresh an entry's
+    modification time, and once the directory grows past `max_bytes` the least
+    recently used entries are deleted. Writes are atomic, so concurrent
+    processes never see partial entries.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Hash the given parts into a cache key."""
+        payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for a key, or None if it is missing or expired."""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self._count(hit=False)
+            return None
+
+        expires = entry.get('expires')
+        if expires is not None and expires < time.time():
+            self._remove(path)
+            self._count(hit=False)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count(hit=True)
+        return entry['value']
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, expiring after `ttl` seconds, or never if `ttl` is None."""
+        path = self._path(key)
+        entry = {'expires': time.time() + ttl if ttl is not None else None, 'value': value}
+        data = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            # Scan before writing, so that the new entry isn't counted twice.
+            self._current_size()
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error writing cache entry {path}: {e}")
+            self._remove(Path(tmp_path))
+            return
+
+        with self._lock:
+            self._size += len(data) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        """Remove every entry."""
+        with self._lock:
+            for path in self._entries():
+                self._remove(path)
+            self._size = 0
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _entries(self):
+        return self.directory.glob('*/*.json')
+
+    def _current_size(self) -> int:
+        """Return the size of the cache, scanning the directory the first time."""
+        if self._size is None:
+            self._size = sum(path.stat().st_size for path in self._entries())
+        return self._size
+
+    def _evict(self) -> None:
+        """Delete least recently used entries until the cache is at 90% of max_bytes."""
+        entries = []
+        for path in self._entries():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, entry_size, path in sorted(entries):
+            if size <= target:
+                break
+            self._remove(path)
+            size -= entry_size
+            evicted += 1
+
+        self._size = size
+        logger.info(f"Evicted {evicted} entries from cache {self.directory}")
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,91 @@
+"""URL canonicalization for de-duplicating sitemap entries."""
+
+from fnmatch import fnmatch
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lib.sitemap import SitemapEntry
+from settings import Config
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class URLCanonicalizer:
+    """
+    Maps URL variants of the same page to one canonical key.
+
+    The key is only used to group URLs: the page that gets processed is always
+    the first URL seen for a key, so a key that doesn't resolve (an http URL
+    rewritten to https, say) never gets fetched. Which variants are treated as
+    the same page is controlled by the canonical_* settings.
+    """
+
+    def __init__(self, config: Config):
+        self.enabled = config.canonicalize_urls
+        self.https = config.canonical_https
+        self.trailing_slash = config.canonical_ignore_trailing_slash
+        self.lowercase_path = config.canonical_lowercase_path
+        self.ignore_params = [pattern.lower() for pattern in config.canonical_ignore_params]
+
+    def canonicalize(self, url: str) -> str:
+        """Return the canonical key for a URL, or the URL itself if canonicalization is disabled."""
+        url = url.strip()
+        if not self.enabled:
+            return url
+
+        try:
+            parts = urlsplit(url)
+            port = parts.port
+        except ValueError:
+            return url
+
+        scheme = parts.scheme.lower()
+        if self.https and scheme == 'http':
+            scheme = 'https'
+        netloc = (parts.hostname or '').lower()
+        if port and port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{netloc}:{port}"
+
+        path = parts.path or '/'
+        if self.lowercase_path:
+            path = path.lower()
+        if self.trailing_slash and path != '/':
+            path = path.rstrip('/') or '/'
+
+        params = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                  if not self._is_ignored(key)]
+        query = urlencode(sorted(params))
+
+        # Fragments never reach the server, so they are always dropped.
+        return urlunsplit((scheme, netloc, path, query, ''))
+
+    def dedupe(self, entries: Iterable[SitemapEntry], aliases: Dict[str, List[str]],
+               known_aliases: Optional[Dict[str, str]] = None) -> Iterator[SitemapEntry]:
+        """
+        Yield the first entry for each canonical URL.
+
+        Args:
+            entries (Iterable[SitemapEntry]): The sitemap entries, possibly with duplicates.
+            aliases (Dict[str, List[str]]): Filled in with the other URLs seen for each yielded URL.
+            known_aliases (Dict[str, str], optional): URLs recorded as aliases on earlier runs and the
+                URL they were processed as, which stays the processed URL. Defaults to None.
+
+        Yields:
+            SitemapEntry: One entry per canonical URL, in the order they were first seen.
+        """
+        known_aliases = known_aliases or {}
+        representatives = {}
+        for entry in entries:
+            loc = known_aliases.get(entry.loc, entry.loc)
+            key = self.canonicalize(loc)
+            representative = representatives.get(key)
+            if representative is None:
+                representatives[key] = representative = loc
+                aliases[loc] = []
+                yield entry._replace(loc=loc)
+            if entry.loc != representative and entry.loc not in aliases[representative]:
+                aliases[representative].append(entry.loc)
+
+    def _is_ignored(self, param: str) -> bool:
+        param = param.lower()
+        return any(fnmatch(param, pattern) for pattern in self.ignore_params)
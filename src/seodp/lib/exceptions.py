@@ -21,4 +21,8 @@ class DataProcessingError(Exception):
 
 class ConfigurationError(Exception):
     """Raised when there's a problem with the configuration."""
-    pass
\ No newline at end of file
+    pass
+
+class TokenBudgetExceeded(GeminiAPIError):
+    """Raised instead of calling the Gemini API once the run's token budget is spent."""
+    pass
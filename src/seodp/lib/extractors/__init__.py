@@ -1,7 +1,12 @@
 """Module that provides a unified interface for extracting data from various sources."""
 
-from copy import deepcopy
-from typing import Dict
+import concurrent.futures
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from lib.cache import DiskCache
+from lib.exceptions import AuthenticationError, ConfigurationError
 from lib.extractors.ga4 import GA4Extractor
 from lib.extractors.gsc import GSCExtractor
 from lib.extractors.psi import PSIExtractor
@@ -18,9 +23,15 @@ class ExtractorTools:
     A class that provides a unified interface for extracting data from various sources.
     """
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, cache: Optional[DiskCache] = None):
         self.config = config
+        self.cache = cache
         self.tools = self._load_extractors(config)
+        # One slot per extractor for every URL that can be in flight at once.
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.tools) * config.max_concurrency),
+            thread_name_prefix="extractor"
+        )
 
 
     @staticmethod
@@ -32,32 +43,159 @@ class ExtractorTools:
                 extractor = extractor_class(config)
                 extractors[extractor.name] = extractor
             except Exception as e:
-                logger.error(f"Error loading extractor {extractor.name}: {e}")
+                logger.error(f"Error loading extractor {extractor_class.__name__}: {e}")
         return extractors
 
 
-    def extract_data(self, url: str, start_date: str = None, end_date: str = None) -> Dict[str, Dict]:
+    def prefetch(self, start_date: str, end_date: str) -> None:
+        """
+        Let extractors with a bulk mode load a whole date range up front, so that
+        subsequent calls to extract_data for that range are served from memory.
+
+        Args:
+            start_date (str): The start date for the date range.
+            end_date (str): The end date for the date range.
+        """
+        futures = [
+            self.executor.submit(self._prefetch_tool, tool_name, tool, start_date, end_date)
+            for tool_name, tool in self.tools.items()
+        ]
+        for future in futures:
+            future.result()
+
+
+    def revalidate(self, url: str, state: Optional[Dict], lastmod: Optional[str] = None) -> Tuple[bool, Optional[Dict]]:
+        """
+        Check whether a page changed since its validators were recorded.
+
+        Args:
+            url (str): The page URL.
+            state (Dict, optional): The validators stored for the page on a previous run.
+            lastmod (str, optional): The page's lastmod from the sitemap. Defaults to None.
+
+        Returns:
+            Tuple[bool, Optional[Dict]]: Whether the page is unchanged, and its new validators (None if it couldn't be checked).
+        """
+        tool = self.tools.get("URLExtractor")
+        if tool is None:
+            return False, None
+        return tool.revalidate(url, state, lastmod)
+
+
+    def extract_data(self, url: str, start_date: str = None, end_date: str = None,
+                     reuse: Optional[Dict[str, Dict]] = None) -> Tuple[Dict[str, Dict], List[str]]:
         """
         Extract data from various sources for a given URL and date range.
 
+        All extractors run at the same time, each with its own timeout. An extractor
+        that fails or times out is logged and reported as failed, so one slow source
+        doesn't hold up or discard the others. Configuration and authentication
+        errors are raised, since every other URL would fail the same way.
+
         Args:
             url (str): The URL for which data needs to be extracted.
             start_date (str, optional): The start date for the date range. Defaults to None.
             end_date (str, optional): The end date for the date range. Defaults to None.
+            reuse (Dict[str, Dict], optional): Payloads to use instead of running the named extractors. Defaults to None.
 
         Returns:
-            Dict[str, Dict]: A dictionary containing the extracted data, where the keys are the source names and the values are dictionaries containing the extracted data for that source.
+            Tuple[Dict[str, Dict], List[str]]: The extracted data, keyed by source name, and the names of the sources that failed, which have no entry in the data.
         """
+        reuse = reuse or {}
+        started = time.monotonic()
+        futures = {
+            tool_name: self.executor.submit(self._extract_tool, tool_name, tool, url, start_date, end_date)
+            for tool_name, tool in self.tools.items() if tool_name not in reuse
+        }
+
         data = {}
+        failed = []
+        for tool_name in self.tools:
+            if tool_name in reuse:
+                logger.info(f"Reusing unchanged {tool_name} data for URL: {url}")
+                data[tool_name] = reuse[tool_name]
+                continue
+            future = futures[tool_name]
+            timeout = self.config.extractor_timeouts.get(tool_name, self.config.extractor_timeout)
+            remaining = max(0, timeout - (time.monotonic() - started))
+            try:
+                data[tool_name] = future.result(timeout=remaining)
+            except (ConfigurationError, AuthenticationError):
+                for pending in futures.values():
+                    pending.cancel()
+                raise
+            except concurrent.futures.TimeoutError:
+                # If it hasn't started yet, don't let it run and spend API quota on a result nobody reads.
+                future.cancel()
+                logger.error(f"{tool_name} timed out after {timeout}s for URL: {url}")
+                failed.append(tool_name)
+            except Exception as e:
+                logger.error(f"Error extracting data from {tool_name} for URL: {url}: {e}")
+                failed.append(tool_name)
+
+        return data, failed
+
+
+    def close(self) -> None:
+        """Release the extractors' resources at the end of a run. They are set up again if needed."""
+        for tool in self.tools.values():
+            tool.close()
+
+
+    def shutdown(self) -> None:
+        """Release the extractors' resources and stop the extractor pool for good."""
+        self.close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+    @staticmethod
+    def _prefetch_tool(tool_name, tool, start_date: str, end_date: str) -> None:
+        """Prefetch a date range for a single extractor. Runs on the extractor pool."""
+        logger.info(f"Prefetching data from {tool_name}, start date: {start_date}, end date: {end_date}")
+        tool.authenticate()
+        tool.set_date_range(start_date, end_date)
+        tool.prefetch()
+
+
+    def _extract_tool(self, tool_name, tool, url: str, start_date: str, end_date: str) -> Dict:
+        """Extract data for a URL from a single extractor, using the response cache when enabled for it. Runs on the extractor pool."""
+        cache_key = None
+        if self.cache is not None and start_date and end_date and tool_name in self.config.cache_extractors:
+            cache_key = DiskCache.make_key(tool_name, tool.version, url, start_date, end_date)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached {tool_name} data for URL: {url}, start date: {start_date}, end date: {end_date}")
+                return cached
+
+        # Log tool name, URL, and date range in one line
+        logger.info(f"Extracting data from {tool_name} for URL: {url}, start date: {start_date}, end date: {end_date}")
+
+        tool.authenticate()
+        if start_date and end_date:
+            tool.set_date_range(start_date, end_date)
+        data = tool.extract_data(url=url)
+
+        if cache_key is not None and self._has_data(data):
+            self.cache.set(cache_key, data, ttl=self._cache_ttl(end_date))
+        return data
+
+
+    def _cache_ttl(self, end_date: str) -> Optional[int]:
+        """
+        Periods that ended more than cache_settle_days ago don't change any more and are
+        cached forever. GA4 and GSC are still filling in the last few days, so newer ones expire.
+        """
+        settled = date.fromisoformat(end_date) + timedelta(days=self.config.cache_settle_days)
+        if settled < date.today():
+            return None
+        return self.config.cache_open_period_ttl
+
 
-        for tool_name, tool in self.tools.items():
-            
-            # Log tool name, URL, and date range in one line
-            logger.info(f"Extracting data from {tool_name} for URL: {url}, start date: {start_date}, end date: {end_date}")
-            
-            tool.authenticate()
-            if start_date and end_date:
-                tool.set_date_range(start_date, end_date)
-            data[tool_name] = tool.extract_data(url=url)
-
-        return data
\ No newline at end of file
+    @classmethod
+    def _has_data(cls, value: Any) -> bool:
+        """Whether an extractor payload holds any values. Failed extractions are all None and aren't cached."""
+        if isinstance(value, dict):
+            return any(cls._has_data(v) for v in value.values())
+        if isinstance(value, list):
+            return len(value) > 0
+        return value is not None
@@ -0,0 +1,83 @@
+"""Single-pass analysis of page HTML for the URL extractor."""
+
+import json
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import lxml.html
+from lxml.etree import ParserError
+from trafilatura import extract
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+
+class PageAnalysis(NamedTuple):
+    """Structural facts about a page, collected in one traversal of its parsed tree."""
+    tree: Optional[lxml.html.HtmlElement]
+    heading_structure: Dict[str, int]
+    image_count: int
+    schema_markup: List[Dict]
+    # Length of the text inside the first <main> element, None if the page has none.
+    main_text_length: Optional[int] = None
+
+
+def parse_html(raw_html: str) -> Optional[lxml.html.HtmlElement]:
+    """Parse an HTML document with lxml. Returns None for empty documents."""
+    try:
+        return lxml.html.document_fromstring(raw_html)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration.
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        return lxml.html.document_fromstring(raw_html.encode('utf-8'), parser=parser)
+    except ParserError:
+        return None
+
+
+def analyze_html(raw_html: str) -> PageAnalysis:
+    """Parse a page once and collect heading counts, image count and JSON-LD blocks.
+
+    The parsed tree is returned as well so that metadata extraction can reuse it
+    instead of parsing the page again.
+    """
+    tree = parse_html(raw_html) if raw_html else None
+    headings = dict.fromkeys(HEADING_TAGS, 0)
+    image_count = 0
+    schema_markup = []
+    main_text_length = None
+
+    if tree is None:
+        return PageAnalysis(None, headings, image_count, schema_markup)
+
+    for element in tree.iter():
+        tag = element.tag
+        if not isinstance(tag, str):
+            # Comments and processing instructions
+            continue
+        if tag in headings:
+            headings[tag] += 1
+        elif tag == 'img':
+            image_count += 1
+        elif tag == 'main' and main_text_length is None:
+            main_text_length = len(element.text_content().strip())
+        elif tag == 'script' and (element.get('type') or '').strip().lower() == 'application/ld+json':
+            try:
+                schema_markup.append(json.loads(element.text or ''))
+            except ValueError:
+                pass
+
+    return PageAnalysis(tree, headings, image_count, schema_markup, main_text_length)
+
+
+def extract_main_content(raw_html: str) -> Tuple[Optional[str], Optional[Dict]]:
+    """Extract the main text and metadata of a page locally with Trafilatura.
+
+    Returns (text, metadata). Both are None if Trafilatura finds no content.
+    This is a module-level function so it can run in a worker process.
+    """
+    result = extract(raw_html, output_format="json", include_comments=False, with_metadata=True)
+    if not result:
+        return None, None
+
+    metadata = json.loads(result)
+    text = metadata.pop('text', None)
+    metadata.pop('raw_text', None)
+    return text, metadata
@@ -1,13 +1,25 @@
 """Base class for all data extractors"""
 
+import threading
 from abc import ABC, abstractmethod
 from lib.exceptions import AuthenticationError
 
 class DataExtractor(ABC):
+    # Part of the response cache key. Bump it when an extractor's output changes.
+    version = "1"
+
     def __init__(self):
         self.is_authenticated = False
-        self.start_date = None
-        self.end_date = None
+        # Extractors are shared between worker threads, so the date range is per thread.
+        self._local = threading.local()
+
+    @property
+    def start_date(self):
+        return getattr(self._local, 'start_date', None)
+
+    @property
+    def end_date(self):
+        return getattr(self._local, 'end_date', None)
 
     @property
     def name(self):
@@ -21,9 +33,17 @@ class DataExtractor(ABC):
     def extract_data(self, **kwargs):
         pass
 
+    def prefetch(self):
+        """Load data for the current date range in bulk. Extractors without a bulk mode do nothing."""
+        pass
+
+    def close(self):
+        """Release resources held between extractions, such as worker processes."""
+        pass
+
     def set_date_range(self, start_date, end_date):
-        self.start_date = start_date
-        self.end_date = end_date
+        self._local.start_date = start_date
+        self._local.end_date = end_date
 
     def check_authentication(self):
         if not self.is_authenticated:
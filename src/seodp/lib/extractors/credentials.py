@@ -0,0 +1,41 @@
+"""Shared service account credentials for the Google extractors."""
+
+import threading
+from typing import List
+
+from google.auth.transport.requests import Request
+from google.oauth2 import service_account
+
+
+class ServiceAccountCredentials:
+    """
+    Thread-safe holder for delegated service account credentials.
+
+    The key file is read once, and the access token is only refreshed when it is
+    missing or close to expiry, by one thread at a time.
+    """
+
+    def __init__(self, service_account_file, subject_email: str, scopes: List[str]):
+        self.service_account_file = service_account_file
+        self.subject_email = subject_email
+        self.scopes = scopes
+        self.credentials = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return valid credentials, loading or refreshing them if needed."""
+        credentials = self.credentials
+        if credentials is not None and credentials.valid:
+            return credentials
+
+        with self._lock:
+            if self.credentials is None:
+                self.credentials = service_account.Credentials.from_service_account_file(
+                    self.service_account_file,
+                    scopes=self.scopes,
+                    subject=self.subject_email
+                )
+            # `valid` is False once the token is within google-auth's refresh window.
+            if not self.credentials.valid:
+                self.credentials.refresh(Request())
+            return self.credentials
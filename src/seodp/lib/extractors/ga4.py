@@ -1,33 +1,142 @@
-from google.oauth2 import service_account
+import threading
 from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import RunReportRequest, DateRange, Metric, Dimension, Filter, FilterExpression
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest, RunReportRequest, DateRange, Metric, Dimension, Filter, FilterExpression, OrderBy
+)
 from lib.extractors.base import DataExtractor
+from lib.extractors.credentials import ServiceAccountCredentials
 from urllib.parse import urlparse, urlunparse
-from typing import Dict
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 from settings import Config
 
 
+# GA4 accepts at most 5 reports per batchRunReports call and 10 metrics per report.
+MAX_BATCH_REPORTS = 5
+MAX_REPORT_METRICS = 10
+# Page size used when paginating site-wide reports.
+SITE_WIDE_PAGE_SIZE = 100000
+# Number of date ranges kept in memory by the site-wide mode (current and prior period).
+SITE_WIDE_CACHED_RANGES = 2
+
+
+class ReportSpec(NamedTuple):
+    """A logical report needed to build the GA4 payload for a page."""
+    name: str
+    metrics: Tuple[str, ...]
+    dimensions: Tuple[str, ...] = ()
+    filter_name: str = "organic"
+
+
+class PlannedReport(NamedTuple):
+    """A single GA4 request that answers one or more report specs."""
+    metrics: Tuple[str, ...]
+    dimensions: Tuple[str, ...]
+    filter_name: str
+    spec_names: Tuple[str, ...]
+
+
+REPORT_SPECS = [
+    ReportSpec("organic_metrics", ("sessions", "totalUsers", "newUsers")),
+    ReportSpec("bounce_rate", ("bounceRate",)),
+    ReportSpec("referring_sites", ("sessions",), ("sessionSource",)),
+    ReportSpec("avg_time_on_page", ("averageSessionDuration",)),
+    ReportSpec("user_demographics", ("totalUsers",), ("userAgeBracket", "userGender", "country"), "page"),
+    ReportSpec("device_categories", ("totalUsers",), ("deviceCategory",)),
+    ReportSpec("pages_leading_to", ("screenPageViews",), ("pageReferrer",)),
+    ReportSpec("pages_visited_next", ("screenPageViews",), ("pagePath",), "next"),
+    ReportSpec("engagement_rate", ("engagementRate",)),
+    ReportSpec("revenue", ("totalRevenue",)),
+]
+
+# Dimension that identifies the page each filter is scoped to. In site-wide mode
+# the filter on this dimension is dropped and it becomes the leading dimension.
+KEY_DIMENSIONS = {
+    "organic": "pagePath",
+    "page": "pagePath",
+    "next": "pageReferrer",
+}
+
+
+def plan_reports(specs: List[ReportSpec]) -> List[PlannedReport]:
+    """Merge scalar report specs that share a filter into as few requests as possible.
+
+    Specs without dimensions return a single row, so their metrics can be
+    requested together. Specs with dimensions are passed through unchanged.
+    """
+    planned = []
+    scalar_groups: Dict[str, List[ReportSpec]] = {}
+
+    for spec in specs:
+        if spec.dimensions:
+            planned.append(PlannedReport(spec.metrics, spec.dimensions, spec.filter_name, (spec.name,)))
+        else:
+            scalar_groups.setdefault(spec.filter_name, []).append(spec)
+
+    for filter_name, group in scalar_groups.items():
+        metrics: List[str] = []
+        names: List[str] = []
+        for spec in group:
+            new_metrics = [m for m in spec.metrics if m not in metrics]
+            if len(metrics) + len(new_metrics) > MAX_REPORT_METRICS:
+                planned.append(PlannedReport(tuple(metrics), (), filter_name, tuple(names)))
+                metrics, names = [], []
+                new_metrics = list(spec.metrics)
+            metrics.extend(new_metrics)
+            names.append(spec.name)
+        if names:
+            planned.append(PlannedReport(tuple(metrics), (), filter_name, tuple(names)))
+
+    return planned
+
+
+def response_rows(response) -> List[Tuple[Tuple[str, ...], Dict[str, str]]]:
+    """Convert a GA4 report response into (dimension values, {metric: value}) rows."""
+    metric_names = [header.name for header in response.metric_headers]
+    return [
+        (
+            tuple(value.value for value in row.dimension_values),
+            {name: value.value for name, value in zip(metric_names, row.metric_values)}
+        ) for row in response.rows
+    ]
+
+
 class GA4Extractor(DataExtractor):
     def __init__(self, config: Config):
         super().__init__()
         self.config = config
-        self.service_account_file = config.api.service_account_file
-        self.subject_email = config.api.subject_email
-        self.credentials = None
+        self.credentials = ServiceAccountCredentials(
+            config.api.service_account_file,
+            config.api.subject_email,
+            scopes=['https://www.googleapis.com/auth/analytics.readonly']
+        )
         self.ga4_client = None
+        self._auth_lock = threading.Lock()
         self.top_n = config.top_n
+        self.report_plan = plan_reports(REPORT_SPECS)
+        self.site_wide = config.ga4_site_wide
+        self.site_data: Dict[Tuple[str, str], Dict[str, Dict[str, List]]] = {}
+        self._site_lock = threading.Lock()
 
     def authenticate(self) -> None:
-        """Authenticate with Google Analytics 4 API."""
-        self.credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_file,
-            scopes=['https://www.googleapis.com/auth/analytics.readonly'],
-            subject=self.subject_email
-        )
-        self.ga4_client = BetaAnalyticsDataClient(credentials=self.credentials)
+        """Authenticate with Google Analytics 4 API.
+
+        The gRPC client is thread-safe, so it is created once and shared. Later
+        calls only refresh the credentials when the token is close to expiry.
+        """
+        self.config.api.require('service_account_file', 'subject_email')
+        credentials = self.credentials.get()
+        if self.ga4_client is None:
+            with self._auth_lock:
+                if self.ga4_client is None:
+                    self.ga4_client = BetaAnalyticsDataClient(credentials=credentials)
         self.is_authenticated = True
 
+    def prefetch(self) -> None:
+        """Pull site-wide reports for the current date range when site-wide mode is enabled."""
+        if self.site_wide:
+            self._get_site_data()
+
     def extract_data(self, url: str) -> Dict:
         """Extract Google Analytics 4 data for a given page URL."""
         self.check_authentication()
@@ -35,151 +144,188 @@ class GA4Extractor(DataExtractor):
         page_path = urlparse(url).path
         page_path = urlunparse(("", "", page_path, "", "", ""))
 
-        def run_report(metrics: list, dimensions: list, filters: FilterExpression = None) -> dict:
+        if self.site_wide:
+            return self._extract_site_wide(url, page_path)
+
+        filters = self._build_filters(url, page_path)
+        requests = [
+            RunReportRequest(
+                dimensions=[Dimension(name=d) for d in report.dimensions],
+                metrics=[Metric(name=m) for m in report.metrics],
+                date_ranges=[DateRange(start_date=self.start_date, end_date=self.end_date)],
+                dimension_filter=filters[report.filter_name]
+            ) for report in self.report_plan
+        ]
+
+        rows_by_spec = {}
+        for report, response in zip(self.report_plan, self._run_batched(requests)):
+            rows = response_rows(response)
+            for spec_name in report.spec_names:
+                rows_by_spec[spec_name] = rows
+
+        return self._format_data(rows_by_spec)
+
+    def _extract_site_wide(self, url: str, page_path: str) -> Dict:
+        """Serve a page from the site-wide reports for the current date range."""
+        site_data = self._get_site_data()
+        keys = {"pagePath": page_path, "pageReferrer": url}
+
+        rows_by_spec = {}
+        for report in self.report_plan:
+            key = keys[KEY_DIMENSIONS[report.filter_name]]
+            for spec_name in report.spec_names:
+                rows_by_spec[spec_name] = site_data[spec_name].get(key, [])
+
+        return self._format_data(rows_by_spec)
+
+    def _get_site_data(self) -> Dict[str, Dict[str, List]]:
+        """Return site-wide rows for the current date range, fetching them on first use."""
+        date_range = (self.start_date, self.end_date)
+        with self._site_lock:
+            if date_range not in self.site_data:
+                self.check_authentication()
+                while len(self.site_data) >= SITE_WIDE_CACHED_RANGES:
+                    self.site_data.pop(next(iter(self.site_data)))
+                self.site_data[date_range] = self._fetch_site_data()
+            return self.site_data[date_range]
+
+    def _fetch_site_data(self) -> Dict[str, Dict[str, List]]:
+        """Run every planned report once for the whole property and group the rows by page.
+
+        Each report gets its key dimension prepended and the page filter removed,
+        and rows are ordered by the first metric so per-page top N slices match
+        the per-URL reports.
+        """
+        filters = self._build_site_wide_filters()
+        site_data = {}
+
+        for report in self.report_plan:
+            key_dimension = KEY_DIMENSIONS[report.filter_name]
             request = RunReportRequest(
                 property=f"properties/{self.config.property_id}",
-                dimensions=[Dimension(name=d) for d in dimensions],
-                metrics=[Metric(name=m) for m in metrics],
+                dimensions=[Dimension(name=d) for d in (key_dimension,) + report.dimensions],
+                metrics=[Metric(name=m) for m in report.metrics],
                 date_ranges=[DateRange(start_date=self.start_date, end_date=self.end_date)],
-                dimension_filter=filters
+                dimension_filter=filters[report.filter_name],
+                order_bys=[OrderBy(metric=OrderBy.MetricOrderBy(metric_name=report.metrics[0]), desc=True)],
+                limit=SITE_WIDE_PAGE_SIZE
             )
-            response = self.ga4_client.run_report(request)
-            return response
-
-        organic_filter = FilterExpression(
-            and_group={
-                "expressions": [
-                    FilterExpression(
-                        filter=Filter(
-                            field_name="sessionMedium",
-                            string_filter={"value": "organic"}
-                        )
-                    ),
-                    FilterExpression(
-                        filter=Filter(
-                            field_name="pagePath",
-                            string_filter={"value": page_path}
-                        )
-                    )
-                ]
-            }
-        )
 
-        # Added organic sessions, organic users, and organic new users
-        organic_metrics = run_report(
-            metrics=["sessions", "totalUsers", "newUsers"],
-            dimensions=[],
-            filters=organic_filter
-        )
+            rows_by_key: Dict[str, List] = {}
+            for dims, metrics in self._run_paginated(request):
+                rows_by_key.setdefault(dims[0], []).append((dims[1:], metrics))
 
-        bounce_rate = run_report(
-            metrics=["bounceRate"],
-            dimensions=[],
-            filters=organic_filter
-        )
+            for spec_name in report.spec_names:
+                site_data[spec_name] = rows_by_key
 
-        referring_sites = run_report(
-            metrics=["sessions"],
-            dimensions=["sessionSource"],
-            filters=organic_filter
-        )
+        return site_data
 
-        avg_time_on_page = run_report(
-            metrics=["averageSessionDuration"],
-            dimensions=[],
-            filters=organic_filter
-        )
+    def _run_paginated(self, request: RunReportRequest) -> List:
+        """Run a report, following offset/limit pagination until every row is read."""
+        rows = []
+        offset = 0
+        while True:
+            request.offset = offset
+            response = self.ga4_client.run_report(request)
+            rows.extend(response_rows(response))
+            offset += len(response.rows)
+            if not response.rows or offset >= response.row_count:
+                return rows
 
-        user_demographics = run_report(
-            metrics=["totalUsers"],
-            dimensions=["userAgeBracket", "userGender", "country"],
-            filters=FilterExpression(
-                filter=Filter(
-                    field_name="pagePath",
-                    string_filter={"value": page_path}
-                )
+    def _run_batched(self, requests: List[RunReportRequest]) -> List:
+        """Run report requests through batchRunReports, MAX_BATCH_REPORTS at a time."""
+        responses = []
+        for i in range(0, len(requests), MAX_BATCH_REPORTS):
+            batch = BatchRunReportsRequest(
+                property=f"properties/{self.config.property_id}",
+                requests=requests[i:i + MAX_BATCH_REPORTS]
             )
-        )
+            responses.extend(self.ga4_client.batch_run_reports(batch).reports)
+        return responses
 
-        device_categories = run_report(
-            metrics=["totalUsers"],
-            dimensions=["deviceCategory"],
-            filters=organic_filter
+    @staticmethod
+    def _build_filters(url: str, page_path: str) -> Dict[str, FilterExpression]:
+        """Build the filter expressions referenced by ReportSpec.filter_name."""
+        organic = FilterExpression(
+            filter=Filter(
+                field_name="sessionMedium",
+                string_filter={"value": "organic"}
+            )
         )
-
-        pages_leading_to = run_report(
-            metrics=["screenPageViews"],
-            dimensions=["pageReferrer"],
-            filters=organic_filter
+        page = FilterExpression(
+            filter=Filter(
+                field_name="pagePath",
+                string_filter={"value": page_path}
+            )
         )
-
-        pages_visited_next = run_report(
-            metrics=["screenPageViews"],
-            dimensions=["pagePath"],
-            filters=FilterExpression(
-                and_group={
-                    "expressions": [
-                        FilterExpression(
-                            filter=Filter(
-                                field_name="pageReferrer",
-                                string_filter={"value": url}
-                            )
-                        ),
-                        FilterExpression(
-                            filter=Filter(
-                                field_name="sessionMedium",
-                                string_filter={"value": "organic"}
-                            )
-                        ),
-                    ]
-                }
+        referrer = FilterExpression(
+            filter=Filter(
+                field_name="pageReferrer",
+                string_filter={"value": url}
             )
         )
+        return {
+            "organic": FilterExpression(and_group={"expressions": [organic, page]}),
+            "page": page,
+            "next": FilterExpression(and_group={"expressions": [referrer, organic]}),
+        }
 
-        engagement_rate = run_report(
-            metrics=["engagementRate"],
-            dimensions=[],
-            filters=organic_filter
+    @staticmethod
+    def _build_site_wide_filters() -> Dict[str, Optional[FilterExpression]]:
+        """Build the filters for site-wide reports, without the per-page conditions."""
+        organic = FilterExpression(
+            filter=Filter(
+                field_name="sessionMedium",
+                string_filter={"value": "organic"}
+            )
         )
+        return {
+            "organic": organic,
+            "page": None,
+            "next": organic,
+        }
 
+    def _format_data(self, rows_by_spec: Dict[str, List]) -> Dict:
+        """Build the GA4 payload for a page from report rows keyed by spec name."""
 
-        revenue = run_report(
-            metrics=["totalRevenue"],
-            dimensions=[],
-            filters=organic_filter
-        )
+        def scalar(spec_name: str, metric: str):
+            rows = rows_by_spec.get(spec_name)
+            return rows[0][1].get(metric) if rows else None
+
+        def rows(spec_name: str) -> List:
+            return rows_by_spec.get(spec_name) or []
 
         return {
-            "organic_sessions": organic_metrics.rows[0].metric_values[0].value if organic_metrics.rows else None,
-            "organic_users": organic_metrics.rows[0].metric_values[1].value if organic_metrics.rows else None,
-            "organic_new_users": organic_metrics.rows[0].metric_values[2].value if organic_metrics.rows else None,
-            "bounce_rate": bounce_rate.rows[0].metric_values[0].value if bounce_rate.rows else None,
-            "referring_sites": [row.dimension_values[0].value for row in referring_sites.rows[:self.top_n]],
-            "avg_time_on_page": avg_time_on_page.rows[0].metric_values[0].value if avg_time_on_page.rows else None,
-            "engagement_rate": engagement_rate.rows[0].metric_values[0].value if engagement_rate.rows else None,
-            "revenue": revenue.rows[0].metric_values[0].value if revenue.rows else None,           
+            "organic_sessions": scalar("organic_metrics", "sessions"),
+            "organic_users": scalar("organic_metrics", "totalUsers"),
+            "organic_new_users": scalar("organic_metrics", "newUsers"),
+            "bounce_rate": scalar("bounce_rate", "bounceRate"),
+            "referring_sites": [dims[0] for dims, _ in rows("referring_sites")[:self.top_n]],
+            "avg_time_on_page": scalar("avg_time_on_page", "averageSessionDuration"),
+            "engagement_rate": scalar("engagement_rate", "engagementRate"),
+            "revenue": scalar("revenue", "totalRevenue"),
             "user_demographics": [
                 {
-                    "age": row.dimension_values[0].value,
-                    "gender": row.dimension_values[1].value,
-                    "country": row.dimension_values[2].value,
-                    "users": row.metric_values[0].value
-                } for row in user_demographics.rows[:self.top_n]
+                    "age": dims[0],
+                    "gender": dims[1],
+                    "country": dims[2],
+                    "users": metrics["totalUsers"]
+                } for dims, metrics in rows("user_demographics")[:self.top_n]
             ],
             "device_categories": {
-                row.dimension_values[0].value: row.metric_values[0].value
-                for row in device_categories.rows
+                dims[0]: metrics["totalUsers"]
+                for dims, metrics in rows("device_categories")
             },
             "pages_visited_prior": [
                 {
-                    "page": row.dimension_values[0].value,
-                    "views": row.metric_values[0].value
-                } for row in pages_leading_to.rows[:self.top_n]
-            ] if pages_leading_to.rows else [],
+                    "page": dims[0],
+                    "views": metrics["screenPageViews"]
+                } for dims, metrics in rows("pages_leading_to")[:self.top_n]
+            ],
             "pages_visited_next": [
                 {
-                    "page": row.dimension_values[0].value,
-                    "views": row.metric_values[0].value
-                } for row in pages_visited_next.rows[:self.top_n]
-            ] if pages_visited_next.rows else []
-        }
\ No newline at end of file
+                    "page": dims[0],
+                    "views": metrics["screenPageViews"]
+                } for dims, metrics in rows("pages_visited_next")[:self.top_n]
+            ]
+        }
@@ -1,37 +1,68 @@
 """Google Search Console data extractor module."""
 
-from google.oauth2 import service_account
+import threading
 from googleapiclient.discovery import build
 from lib.extractors.base import DataExtractor
-from typing import Dict
+from lib.extractors.credentials import ServiceAccountCredentials
+from typing import Dict, List, Tuple
 
 from settings import Config
 
 
+# Maximum rows the Search Analytics API returns per request.
+GSC_ROW_LIMIT = 25000
+# Number of date ranges kept in memory by the bulk mode (current and prior period).
+BULK_CACHED_RANGES = 2
+
+
 class GSCExtractor(DataExtractor):
     def __init__(self, config: Config):
         super().__init__()
         self.config = config
-        self.service_account_file = config.api.service_account_file
-        self.subject_email = config.api.subject_email
-        self.credentials = None
-        self.search_console_service = None
+        self.credentials = ServiceAccountCredentials(
+            config.api.service_account_file,
+            config.api.subject_email,
+            scopes=['https://www.googleapis.com/auth/webmasters.readonly']
+        )
         self.top_n = config.top_n
+        self.bulk = config.gsc_bulk
+        self.bulk_data: Dict[Tuple[str, str], Tuple[Dict[str, Dict], Dict[str, List[Dict]]]] = {}
+        self._bulk_lock = threading.Lock()
+
+    @property
+    def search_console_service(self):
+        """The discovery client is backed by httplib2, which is not thread-safe, so each thread keeps its own."""
+        return getattr(self._local, 'search_console_service', None)
+
+    @search_console_service.setter
+    def search_console_service(self, service):
+        self._local.search_console_service = service
 
     def authenticate(self) -> None:
-        """Authenticate with Google Search Console API."""
-        self.credentials = service_account.Credentials.from_service_account_file(
-            self.service_account_file,
-            scopes=['https://www.googleapis.com/auth/webmasters.readonly'],
-            subject=self.subject_email
-        )
-        self.search_console_service = build('searchconsole', 'v1', credentials=self.credentials)
+        """Authenticate with Google Search Console API.
+
+        The discovery client is built once per thread and reused. Later calls only
+        refresh the shared credentials when the token is close to expiry.
+        """
+        self.config.api.require('service_account_file', 'subject_email')
+        credentials = self.credentials.get()
+        if self.search_console_service is None:
+            self.search_console_service = build('searchconsole', 'v1', credentials=credentials, cache_discovery=False)
         self.is_authenticated = True
 
+    def prefetch(self) -> None:
+        """Pull page and page/query rows for the current date range when bulk mode is enabled."""
+        if self.bulk:
+            self._get_bulk_data()
+
     def extract_data(self, url: str) -> Dict:
         """Extract Google Search Console data for a given page URL."""
         self.check_authentication()
 
+        if self.bulk:
+            pages, queries = self._get_bulk_data()
+            return self._format_data(pages.get(url, {}), queries.get(url, [])[:self.top_n])
+
         overall_request = {
             'startDate': self.start_date,
             'endDate': self.end_date,
@@ -63,6 +94,51 @@ class GSCExtractor(DataExtractor):
 
         overall_data = overall_response.get('rows', [{}])[0]
 
+        return self._format_data(overall_data, query_response.get('rows', []))
+
+    def _get_bulk_data(self) -> Tuple[Dict[str, Dict], Dict[str, List[Dict]]]:
+        """Return the page index for the current date range, fetching it on first use.
+
+        The index is a pair of dicts keyed by page URL: page totals, and query
+        rows ordered by clicks as the per-URL query report returns them.
+        """
+        date_range = (self.start_date, self.end_date)
+        with self._bulk_lock:
+            if date_range not in self.bulk_data:
+                self.check_authentication()
+                while len(self.bulk_data) >= BULK_CACHED_RANGES:
+                    self.bulk_data.pop(next(iter(self.bulk_data)))
+
+                pages = {row['keys'][0]: row for row in self._query_all(['page'])}
+
+                queries: Dict[str, List[Dict]] = {}
+                for row in self._query_all(['page', 'query']):
+                    queries.setdefault(row['keys'][0], []).append({**row, 'keys': row['keys'][1:]})
+                for rows in queries.values():
+                    rows.sort(key=lambda x: x['clicks'], reverse=True)
+
+                self.bulk_data[date_range] = (pages, queries)
+            return self.bulk_data[date_range]
+
+    def _query_all(self, dimensions: List[str]) -> List[Dict]:
+        """Run a site-wide Search Analytics query, following startRow pagination."""
+        rows = []
+        while True:
+            request = {
+                'startDate': self.start_date,
+                'endDate': self.end_date,
+                'dimensions': dimensions,
+                'rowLimit': GSC_ROW_LIMIT,
+                'startRow': len(rows)
+            }
+            response = self.search_console_service.searchanalytics().query(siteUrl=self.config.site_url, body=request).execute()
+            page = response.get('rows', [])
+            rows.extend(page)
+            if len(page) < GSC_ROW_LIMIT:
+                return rows
+
+    def _format_data(self, overall_data: Dict, query_rows: List[Dict]) -> Dict:
+        """Build the GSC payload for a page from its totals row and top query rows."""
         return {
             "clicks": overall_data.get('clicks', 0),
             "impressions": overall_data.get('impressions', 0),
@@ -75,11 +151,11 @@ class GSCExtractor(DataExtractor):
                     "impressions": row['impressions'],
                     "ctr": row['ctr'],
                     "position": row['position']
-                } for row in query_response.get('rows', [])[:self.top_n]
+                } for row in query_rows[:self.top_n]
             ],
             "top_no_click_queries": [
                 row['keys'][0] for row in sorted(
-                    query_response.get('rows', []),
+                    query_rows,
                     key=lambda x: x['impressions'] - x['clicks'],
                     reverse=True
                 )[:self.top_n]
@@ -15,7 +15,8 @@ class PSIExtractor(DataExtractor):
         self.timeout = config.api.psi_timeout
 
     def authenticate(self) -> None:
-        """No authentication required for this extractor."""
+        """No authentication required for this extractor, only an API key."""
+        self.config.api.require('psi_api_key')
         self.is_authenticated = True
 
     def extract_data(self, url: str) -> Dict:
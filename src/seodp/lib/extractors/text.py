@@ -0,0 +1,72 @@
+"""Text normalization for extracted page content."""
+
+import html
+import re
+from typing import Iterable, Iterator, NamedTuple
+
+# Markup is removed without inserting a separator, like BeautifulSoup's get_text(),
+# which also leaves out comments and the contents of <script> and <style> elements.
+_MARKUP_RE = re.compile(r'<!--.*?-->|<(script|style)\b[^>]*>.*?</\1\s*>|<[^>]*>', re.DOTALL | re.IGNORECASE)
+# What the markup pattern falls back to for a comment or element whose end hasn't been seen.
+_UNCLOSED_RE = re.compile(r'<!--|<(?:script|style)\b', re.IGNORECASE)
+# Everything that is neither alphanumeric nor whitespace. \w also matches '_', which isalnum() rejects.
+_NON_ALNUM_RE = re.compile(r'[^\w\s]|_')
+_WORD_RE = re.compile(r'\S+')
+_TRAILING_WORD_RE = re.compile(r'\S*\Z')
+
+
+class NormalizedText(NamedTuple):
+    text: str
+    word_count: int
+
+
+def _clean(fragment: str) -> str:
+    """Decode entities and drop non-alphanumeric characters from markup-free text."""
+    return _NON_ALNUM_RE.sub('', html.unescape(fragment))
+
+
+def normalize_text(content: str, markup: bool = True) -> NormalizedText:
+    """Strip markup and non-alphanumeric characters, collapse whitespace and count words.
+
+    With `markup` False the content is plain text, such as Trafilatura output, and
+    is only cleaned, so a literal '<' ... '>' in it doesn't swallow the words between.
+    """
+    if markup:
+        content = _MARKUP_RE.sub('', content)
+    words = _WORD_RE.findall(_clean(content))
+    return NormalizedText(' '.join(words), len(words))
+
+
+def _complete_prefix(markup: str) -> int:
+    """Length of the part of `markup` whose tags, comments, scripts and styles are all complete."""
+    # A '<' after the last '>' may be the start of a tag that isn't closed yet.
+    end = markup.find('<', markup.rfind('>') + 1)
+    end = len(markup) if end == -1 else end
+    for match in _MARKUP_RE.finditer(markup, 0, end):
+        if _UNCLOSED_RE.match(match.group()) and match.group(1) is None:
+            return match.start()
+    return end
+
+
+def iter_normalized_words(chunks: Iterable[str]) -> Iterator[str]:
+    """Streaming variant of normalize_text that yields words as chunks of markup arrive.
+
+    Markup and words that straddle a chunk boundary are carried over to the next
+    chunk, so the words produced match normalize_text on the joined input.
+    """
+    pending_markup = ''
+    pending_word = ''
+
+    for chunk in chunks:
+        markup = pending_markup + chunk
+        # Hold back unterminated markup until its end arrives.
+        complete = _complete_prefix(markup)
+        markup, pending_markup = markup[:complete], markup[complete:]
+
+        text = pending_word + _MARKUP_RE.sub('', markup)
+        # Hold back the last word, which may continue in the next chunk.
+        trailing = _TRAILING_WORD_RE.search(text)
+        text, pending_word = text[:trailing.start()], trailing.group()
+        yield from _WORD_RE.findall(_clean(text))
+
+    yield from _WORD_RE.findall(_clean(pending_word + _MARKUP_RE.sub('', pending_markup)))
@@ -1,20 +1,46 @@
 """ Extract SEO content and metadata from a given URL using ScrapingBee API. """
 
+import codecs
+import hashlib
 import json
 import logging
-from typing import Dict, Union, List
-from bs4 import BeautifulSoup
+import multiprocessing
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Union, NamedTuple, Optional, Tuple
 
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
 from scrapingbee import ScrapingBeeClient
 from trafilatura import extract
 
+from lib.extractors.analysis import PageAnalysis, analyze_html, extract_main_content
 from lib.extractors.base import DataExtractor
+from lib.extractors.text import NormalizedText, normalize_text
 from lib.exceptions import AuthenticationError
 
 from settings import Config
 
 logger = logging.getLogger(__name__)
 
+# Number of directly fetched pages kept in memory for conditional requests.
+FETCHED_PAGES_CACHE_SIZE = 256
+# A <meta charset> or http-equiv Content-Type declaration, looked for in the first bytes of a page.
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.IGNORECASE)
+META_CHARSET_SCAN_BYTES = 4096
+
+
+class FetchedPage(NamedTuple):
+    """A page fetched over plain HTTP, with the validators needed to revalidate it."""
+    html: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
 class URLExtractor(DataExtractor):
     READABILITY_JS = """
     (async function main () {
@@ -49,9 +75,25 @@ class URLExtractor(DataExtractor):
         self.config = config
         self.api_key = config.api.scrapingbee_api_key
         self.client = None
+        self.content_extraction = config.content_extraction
+        self.fetch_strategy = config.fetch_strategy
+        self._content_pool = None
+        self._content_pool_lock = threading.Lock()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._fetched_pages: "OrderedDict[str, FetchedPage]" = OrderedDict()
+        self._fetched_lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        # Payloads differ between content extraction modes and fetch strategies, so they are cached separately.
+        return f"1-{self.content_extraction}-{self.fetch_strategy}"
 
     def authenticate(self) -> None:
-        """Authenticate with ScrapingBee API."""
+        """Authenticate with ScrapingBee API. The client is created once and reused."""
+        if self.is_authenticated:
+            return
+        self.config.api.require('scrapingbee_api_key')
         try:
             self.client = ScrapingBeeClient(api_key=self.api_key)
             self.is_authenticated = True
@@ -60,37 +102,29 @@ class URLExtractor(DataExtractor):
             raise AuthenticationError("Failed to authenticate with ScrapingBee API")
 
     def extract_data(self, url: str) -> Dict[str, Union[str, None]]:
-        """Extract SEO content and metadata from a given URL."""
+        """Extract SEO content and metadata from a given URL.
+
+        With the 'auto' fetch strategy the page is first fetched over plain HTTP,
+        and only rendered in ScrapingBee's browser when it looks client-rendered.
+        """
         self.check_authentication()
 
+        if self.fetch_strategy == "auto":
+            raw_html = self._fetch_direct(url)
+            if raw_html:
+                payload, page = self._build_payload(raw_html)
+                if not self._needs_rendering(payload, page):
+                    return payload
+                logger.info(f"{url} looks client-rendered, rendering it in the browser")
+
         try:
-            with self.client.get(
-                url,
-                headers=self.HEADERS,
-                params={
-                    "block_ads": "True",
-                    "json_response": "True",
-                    "wait_browser": "load",
-                    "js_scenario": {
-                        "strict": False,
-                        "instructions": [{"evaluate": self.READABILITY_JS}],
-                    },
-                },
-            ) as response:
+            with self.client.get(url, headers=self.HEADERS, params=self._render_params()) as response:
                 if response.status_code == 200:
                     url_data = response.json()
-                    clean_content = self._extract_clean_content(url_data)
                     raw_html = self._extract_raw_html(url_data)
-                    metadata = self._extract_metadata(raw_html)
-
-                    return {
-                        "clean_content": clean_content,
-                        "metadata": metadata,
-                        "word_count": self._get_word_count(clean_content),
-                        "heading_structure": self._get_heading_structure(raw_html),
-                        "image_count": self._get_image_count(raw_html),
-                        "schema_markup": self._get_schema_markup(raw_html)
-                    }
+                    if self.content_extraction == "local":
+                        return self.build_payload(raw_html)
+                    return self.build_payload(raw_html, readability_html=self._extract_readability_html(url_data))
 
                 logger.error(f"ScrapingBee error: {response.status_code}")
         except Exception as e:
@@ -105,12 +139,232 @@ class URLExtractor(DataExtractor):
             "schema_markup": None
         }
 
-    def _extract_clean_content(self, url_data: Dict) -> Union[str, None]:
-        """Extract clean content from ScrapingBee response."""
+    def build_payload(self, raw_html: str, readability_html: Optional[str] = None) -> Dict[str, Union[str, None]]:
+        """Build the URL payload from rendered HTML.
+
+        With `readability_html`, the main content is the Readability output from
+        the browser. Without it (local mode, or Readability failed in the browser),
+        main content and metadata are extracted locally with Trafilatura in a worker
+        process. Needs no network access, so it can be run against saved pages.
+        """
+        return self._build_payload(raw_html, readability_html)[0]
+
+    def _build_payload(self, raw_html: str, readability_html: Optional[str] = None) -> Tuple[Dict, PageAnalysis]:
+        """Build the URL payload and return it along with the page analysis it came from."""
+        # Parse the page once; the tree is handed on to Trafilatura for metadata.
+        page = analyze_html(raw_html)
+
+        if readability_html is None:
+            # Trafilatura returns plain text, in which a '<' is just a character.
+            content, metadata = self._extract_content_locally(raw_html)
+            clean_content = self._format_content(content, markup=False) if content else None
+        else:
+            content, metadata = readability_html, self._extract_metadata(page.tree)
+            clean_content = self._format_content(content) if content else None
+
+        return {
+            "clean_content": clean_content.text if clean_content else None,
+            "metadata": metadata,
+            "word_count": clean_content.word_count if clean_content else None,
+            "heading_structure": page.heading_structure,
+            "image_count": page.image_count,
+            "schema_markup": page.schema_markup
+        }, page
+
+    def _needs_rendering(self, payload: Dict, page: PageAnalysis) -> bool:
+        """Whether a directly fetched page looks like its content is rendered client-side."""
+        word_count = payload["word_count"] or 0
+        if word_count < self.config.render_min_word_count:
+            return True
+        # An empty <main> is a typical single-page-app shell.
+        return page.main_text_length == 0
+
+    def _get_session(self) -> requests.Session:
+        """Return the pooled keep-alive session used for direct fetches."""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=max(10, self.config.max_concurrency))
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    # Only advertise encodings the installed urllib3 can decode (br needs brotli).
+                    session.headers.update({**self.HEADERS, "Accept-Encoding": DEFAULT_ACCEPT_ENCODING})
+                    self._session = session
+        return self._session
+
+    def revalidate(self, url: str, state: Optional[Dict], lastmod: Optional[str] = None) -> Tuple[bool, Optional[Dict]]:
+        """Cheaply check whether a page changed since `state` was recorded.
+
+        `state` holds the etag, last_modified, lastmod and content_hash stored
+        for the page on a previous run. The page is unchanged if the sitemap
+        lastmod is the same as before, if a conditional request returns 304, or
+        if the body hashes to the same content_hash. Returns (unchanged, new state).
+        The new state is None if the page couldn't be fetched.
+        """
+        state = state or {}
+        if lastmod and lastmod == state.get("lastmod") and state.get("content_hash"):
+            return True, state
+
+        response = self._conditional_get(url, state.get("etag"), state.get("last_modified"))
+        if response is None:
+            return False, None
+        if response.status_code == 304 and state.get("content_hash"):
+            return True, {**state, "lastmod": lastmod or state.get("lastmod")}
+        if response.status_code != 200:
+            return False, None
+
+        if "html" in response.headers.get("Content-Type", ""):
+            self._remember_page(url, FetchedPage(self._decode_html(response), response.headers.get("ETag"), response.headers.get("Last-Modified")))
+
+        new_state = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "lastmod": lastmod,
+            "content_hash": hashlib.sha256(response.content).hexdigest(),
+        }
+        return new_state["content_hash"] == state.get("content_hash"), new_state
+
+    def _fetch_direct(self, url: str) -> Optional[str]:
+        """Fetch a page over plain HTTP, revalidating an earlier copy with ETag/Last-Modified.
+
+        Returns None when the page can't be fetched or isn't HTML, so the caller
+        falls back to browser rendering.
+        """
+        with self._fetched_lock:
+            previous = self._fetched_pages.get(url)
+
+        response = self._conditional_get(url, previous.etag if previous else None, previous.last_modified if previous else None)
+        if response is None:
+            return None
+        if response.status_code == 304 and previous:
+            return previous.html
+        if response.status_code != 200 or "html" not in response.headers.get("Content-Type", ""):
+            logger.info(f"Direct fetch of {url} returned {response.status_code} {response.headers.get('Content-Type')}")
+            return None
+
+        page = FetchedPage(self._decode_html(response), response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        self._remember_page(url, page)
+        return page.html
+
+    @staticmethod
+    def _decode_html(response: requests.Response) -> str:
+        """Decode a page's HTML.
+
+        Without a charset in the Content-Type header, requests decodes text as
+        ISO-8859-1, which garbles UTF-8 pages that only declare it in a <meta> tag.
+        In that case the <meta> declaration is used, or else the detected encoding.
+        """
+        if "charset" in response.headers.get("Content-Type", "").lower():
+            return response.text
+        match = META_CHARSET_RE.search(response.content[:META_CHARSET_SCAN_BYTES])
+        encoding = match.group(1).decode("ascii") if match else None
+        try:
+            codecs.lookup(encoding or "")
+        except LookupError:
+            encoding = response.apparent_encoding or "utf-8"
+        return response.content.decode(encoding, errors="replace")
+
+    def _conditional_get(self, url: str, etag: Optional[str], last_modified: Optional[str]) -> Optional[requests.Response]:
+        """GET a page on the pooled session, sending whichever validators are known."""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            return self._get_session().get(url, headers=headers, timeout=self.config.fetch_timeout)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Direct fetch failed for {url}: {e}")
+            return None
+
+    def _remember_page(self, url: str, page: FetchedPage) -> None:
+        """Keep a fetched page in memory so a later fetch can be a conditional request."""
+        with self._fetched_lock:
+            self._fetched_pages[url] = page
+            self._fetched_pages.move_to_end(url)
+            while len(self._fetched_pages) > FETCHED_PAGES_CACHE_SIZE:
+                self._fetched_pages.popitem(last=False)
+
+    def _render_params(self) -> Dict:
+        """ScrapingBee parameters. Readability mode also runs Readability in the browser."""
+        params = {
+            "block_ads": "True",
+            "json_response": "True",
+            "wait_browser": "load",
+        }
+        if self.content_extraction != "local":
+            params["js_scenario"] = {
+                "strict": False,
+                "instructions": [{"evaluate": self.READABILITY_JS}],
+            }
+        return params
+
+    def _extract_content_locally(self, raw_html: str):
+        """Run Trafilatura main-content extraction on the CPU worker pool.
+
+        A page that takes longer than content_timeout, or whose worker crashed,
+        gets no content, and the pool's workers are terminated and the pool
+        replaced so later pages aren't affected. Pages that were running in a
+        pool discarded because of another page are tried once more in the new one.
+        """
+        if not raw_html:
+            return None, None
+        for attempt in range(2):
+            pool = self._get_content_pool()
+            try:
+                return pool.submit(extract_main_content, raw_html).result(timeout=self.config.content_timeout)
+            except TimeoutError:
+                logger.error(f"Content extraction timed out after {self.config.content_timeout}s")
+            except BrokenProcessPool:
+                if attempt == 0 and self._content_pool is not pool:
+                    continue
+                logger.error("Content extraction worker crashed")
+            self._discard_content_pool(pool)
+            return None, None
+
+    def _get_content_pool(self) -> ProcessPoolExecutor:
+        with self._content_pool_lock:
+            if self._content_pool is None:
+                # Spawned rather than forked, since extraction runs alongside worker threads.
+                self._content_pool = ProcessPoolExecutor(
+                    max_workers=self.config.content_workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._content_pool
+
+    def _discard_content_pool(self, pool: ProcessPoolExecutor) -> None:
+        """Stop using a broken or stuck pool, killing its workers. The next page starts a new one."""
+        with self._content_pool_lock:
+            if self._content_pool is pool:
+                self._content_pool = None
+        self._terminate_workers(pool)
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self) -> None:
+        """Shut down the content extraction pool. It is started again if needed."""
+        with self._content_pool_lock:
+            pool, self._content_pool = self._content_pool, None
+        if pool is not None:
+            # Nothing should be running at the end of a run; don't wait on a worker that is stuck.
+            self._terminate_workers(pool)
+            pool.shutdown(cancel_futures=True)
+
+    @staticmethod
+    def _terminate_workers(pool: ProcessPoolExecutor) -> None:
+        """Kill a pool's worker processes. shutdown() alone waits for a stuck worker to finish."""
+        # ProcessPoolExecutor has no public way to stop its workers before Python 3.14.
+        for process in list((getattr(pool, "_processes", None) or {}).values()):
+            if process.is_alive():
+                process.terminate()
+
+    def _extract_readability_html(self, url_data: Dict) -> Union[str, None]:
+        """Extract the Readability content HTML from ScrapingBee response."""
         if isinstance(url_data, dict) and "evaluate_results" in url_data:
             content = url_data["evaluate_results"]
             if isinstance(content, list) and len(content) > 0:
-                return self._format_content(content[0])
+                return content[0]
         if isinstance(url_data, dict) and "js_scenario_report" in url_data:
             report = url_data["js_scenario_report"]
             logger.error(f"ScrapingBee error: {json.dumps(report, indent=2)}")
@@ -122,10 +376,10 @@ class URLExtractor(DataExtractor):
             return url_data["body"]
         return None
 
-    def _extract_metadata(self, raw_html: str) -> Union[Dict, None]:
-        """Extract metadata using Trafilatura."""
-        if raw_html:
-            metadata = extract(raw_html, output_format="json", include_comments=False, with_metadata=True)
+    def _extract_metadata(self, tree) -> Union[Dict, None]:
+        """Extract metadata using Trafilatura from an already parsed lxml tree."""
+        if tree is not None:
+            metadata = extract(tree, output_format="json", include_comments=False, with_metadata=True)
 
             if isinstance(metadata, str):
                 try:
@@ -146,46 +400,9 @@ class URLExtractor(DataExtractor):
         return None
 
     @staticmethod
-    def _format_content(content: str) -> str:
-        """Format the extracted content to clean text. Removing any HTML, Scripts, 
-        non-alphanumeric characters, execcesive whitespaces, etc."""
-
-        # Remove HTML tags
-        content = BeautifulSoup(content, 'html.parser').get_text()
-
-        # Remove non-alphanumeric characters
-        content = ''.join(e for e in content if e.isalnum() or e.isspace())
-
-        # Remove excessive whitespaces
-        content = ' '.join(content.split())
-
-        return content
-
-    def _get_word_count(self, content: str) -> int:
-        """Get word count from clean content."""
-        return len(content.split())
-
-    def _get_heading_structure(self, raw_html: str) -> Dict[str, int]:
-        """Get heading structure from raw HTML."""
-        soup = BeautifulSoup(raw_html, 'html.parser')
-        headings = {'h1': 0, 'h2': 0, 'h3': 0, 'h4': 0, 'h5': 0, 'h6': 0}
-        for tag in soup.find_all(['h1', 'h2', 'h3', 'h4', 'h5', 'h6']):
-            headings[tag.name] += 1
-        return headings
-
-    def _get_image_count(self, raw_html: str) -> int:
-        """Get the count of images from raw HTML."""
-        soup = BeautifulSoup(raw_html, 'html.parser')
-        return len(soup.find_all('img'))
-
-    def _get_schema_markup(self, raw_html: str) -> List[Dict]:
-        """Get schema markup from raw HTML."""
-        soup = BeautifulSoup(raw_html, 'html.parser')
-        schema_tags = soup.find_all('script', type='application/ld+json')
-        schema_data = []
-        for tag in schema_tags:
-            try:
-                schema_data.append(json.loads(tag.string))
-            except:
-                pass
-        return schema_data
\ No newline at end of file
+    def _format_content(content: str, markup: bool = True) -> NormalizedText:
+        """Format the extracted content to clean text. Removing any HTML, Scripts,
+        non-alphanumeric characters, execcesive whitespaces, etc. The word count
+        is taken in the same pass. Plain text (`markup` False) keeps anything
+        between '<' and '>'."""
+        return normalize_text(content, markup=markup)
@@ -1,11 +1,7 @@
 import json
 from typing import Dict, Any, List
 from loguru import logger
-from .url import URLManager
-from .data import DataManager
-from .aggregation import AggregationManager
-from .llm import LLMManager
-from lib.api.email import EmailHandler
+from .context import ServiceContext
 
 from settings import Config
 
@@ -13,32 +9,60 @@ from settings import Config
 class Manager:
     def __init__(self, config: Config):
         self.config = config
-        self.url_manager = URLManager(config)
-        self.data_manager = DataManager(config)
-        self.aggregation_manager = AggregationManager(config)
-        self.llm_manager = LLMManager(config)
-        self.email_handler = EmailHandler(config)
+        self.context = ServiceContext(config)
+
+    @property
+    def url_manager(self):
+        return self.context.url_manager
+
+    @property
+    def data_manager(self):
+        return self.context.data_manager
+
+    @property
+    def aggregation_manager(self):
+        return self.context.aggregation_manager
+
+    @property
+    def llm_manager(self):
+        return self.context.llm_manager
+
+    @property
+    def email_handler(self):
+        return self.context.email_handler
 
     def run_schedule(self):
         logger.info("Starting scheduled run")
-        all_insights = self.url_manager.process_all_urls()
+        self.llm_manager.start_run()
+        try:
+            all_insights = self.url_manager.process_all_urls()
+        finally:
+            # Don't keep extraction worker processes around until the next scheduled run.
+            self.context.extractor_tools.close()
         current_period = self.data_manager.get_current_period()
         
         aggregated_insights = self.aggregation_manager.aggregate_insights(all_insights)
         report_content = self.email_handler.format_report(aggregated_insights)
         self.email_handler.send_report(report_content)
         
+        logger.info(f"LLM usage: {self.context.llm_telemetry.format_summary()}")
+        for name, cache in (("Response", self.context.response_cache), ("LLM", self.context.llm_cache)):
+            if cache is not None:
+                logger.info(f"{name} cache: {cache.hits} hits, {cache.misses} misses")
         logger.info("Scheduled run completed")
 
     def run_url_test(self, url: str) -> Dict[str, Any]:
         logger.info(f"Running URL test for: {url}")
         current_period = self.data_manager.get_current_period()
         prior_period = self.data_manager.get_prior_period()
+        # Site-wide and bulk modes load whole periods; do it outside the extractor timeout.
+        self.data_manager.prefetch(current_period)
+        self.data_manager.prefetch(prior_period)
         
         current_data = self.data_manager.get_current_data_live(url)
         prior_data = self.data_manager.get_prior_data_db(url)
         
-        if not prior_data:
+        if not prior_data or self.data_manager.failed_sources(prior_data):
             prior_data = self.data_manager.get_prior_data_live(url)
         
         insights = self.llm_manager.generate_structured_insights(current_data, prior_data)
@@ -49,7 +73,8 @@ class Manager:
             'prior_period': prior_period,
             'current_data': current_data, 
             'prior_data': prior_data,
-            'insights': insights
+            'insights': insights,
+            'llm_usage': self.context.llm_telemetry.summary()['by_label'].get(url)
         }
 
     def run_sitemap_test(self, urls: List[str]) -> Dict[str, Any]:
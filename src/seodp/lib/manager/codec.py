@@ -0,0 +1,155 @@
+"""Compression of the JSON columns stored by the data manager."""
+
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+from loguru import logger
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency: pip install seo-dp[zstd]
+    zstandard = None
+
+# The first byte of a stored blob says how the rest of it is encoded. Rows written
+# before compression was added are TEXT and are returned as they are.
+FORMAT_ZLIB = 0x01
+# Followed by the 4-byte id of the dictionary in compression_dicts, 0 for none.
+FORMAT_ZSTD = 0x02
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+DICT_SIZE = 112640
+DICT_MIN_SAMPLES = 64
+
+
+class BlobCodec:
+    """
+    Encodes JSON text as versioned compressed blobs and decodes any stored format.
+
+    With `method` 'zstd' (the default), rows are compressed with Zstandard using
+    the newest dictionary in the compression_dicts table, if one has been
+    trained. Without the zstandard package it falls back to zlib, and 'none'
+    stores plain text as before.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, method: str = 'zstd'):
+        self.conn = conn
+        if method == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, compressing stored data with zlib")
+            method = 'zlib'
+        self.method = method
+        self._lock = threading.Lock()
+        self._dicts: Dict[int, 'zstandard.ZstdCompressionDict'] = {}
+        self._compressor = None
+        self._compressor_dict_id = 0
+        self._decompressors: Dict[int, 'zstandard.ZstdDecompressor'] = {}
+        conn.execute('''CREATE TABLE IF NOT EXISTS compression_dicts
+                        (id INTEGER PRIMARY KEY, dict BLOB, created_date TEXT)''')
+
+    def encode(self, text: str) -> Union[str, bytes]:
+        if self.method == 'none':
+            return text
+        raw = text.encode('utf-8')
+        if self.method == 'zlib':
+            return bytes([FORMAT_ZLIB]) + zlib.compress(raw, ZLIB_LEVEL)
+        if self._compressor is None:
+            self.reload()
+        with self._lock:
+            frame = self._compressor.compress(raw)
+            return bytes([FORMAT_ZSTD]) + self._compressor_dict_id.to_bytes(4, 'big') + frame
+
+    def decode(self, value: Union[str, bytes, None]) -> Optional[str]:
+        if value is None or isinstance(value, str):
+            return value
+        version = value[0]
+        if version == FORMAT_ZLIB:
+            return zlib.decompress(value[1:]).decode('utf-8')
+        if version == FORMAT_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("The database holds zstd-compressed rows; install the zstandard package to read them")
+            dict_id = int.from_bytes(value[1:5], 'big')
+            with self._lock:
+                return self._decompressor(dict_id).decompress(value[5:]).decode('utf-8')
+        raise ValueError(f"Unknown stored data format {version}")
+
+    def train_dictionary(self, samples: List[str]) -> Optional[int]:
+        """
+        Train a Zstandard dictionary on sample rows, store it and use it for new rows.
+
+        Returns the new dictionary's id, or None if zstd isn't in use or there
+        aren't enough samples to train on.
+        """
+        if self.method != 'zstd' or len(samples) < DICT_MIN_SAMPLES:
+            return None
+        try:
+            trained = zstandard.train_dictionary(DICT_SIZE, [sample.encode('utf-8') for sample in samples])
+        except zstandard.ZstdError as e:
+            logger.warning(f"Could not train a compression dictionary: {e}")
+            return None
+
+        with self.conn:
+            c = self.conn.execute("INSERT INTO compression_dicts (dict, created_date) VALUES (?, ?)",
+                                  (trained.as_bytes(), datetime.now().strftime('%Y-%m-%d')))
+        self.reload()
+        logger.info(f"Trained compression dictionary {c.lastrowid} on {len(samples)} rows")
+        return c.lastrowid
+
+    def drop_unused_dictionaries(self) -> None:
+        """
+        Delete the dictionaries that no stored row references.
+
+        The newest dictionary and the one this codec compresses with are always
+        kept, since another process may be writing rows with them.
+        """
+        keep = {self._compressor_dict_id}
+        newest = self.conn.execute("SELECT MAX(id) FROM compression_dicts").fetchone()[0]
+        if newest is not None:
+            keep.add(newest)
+        for column in ('data', 'insights'):
+            c = self.conn.execute(f"SELECT DISTINCT substr({column}, 2, 4) FROM data "
+                                  f"WHERE typeof({column}) = 'blob' AND substr({column}, 1, 1) = ?",
+                                  (bytes([FORMAT_ZSTD]),))
+            keep.update(int.from_bytes(row[0], 'big') for row in c.fetchall())
+
+        unused = [row[0] for row in self.conn.execute("SELECT id FROM compression_dicts").fetchall() if row[0] not in keep]
+        if not unused:
+            return
+        with self.conn:
+            self.conn.executemany("DELETE FROM compression_dicts WHERE id=?", [(dict_id,) for dict_id in unused])
+        with self._lock:
+            for dict_id in unused:
+                self._dicts.pop(dict_id, None)
+                self._decompressors.pop(dict_id, None)
+        logger.info(f"Dropped {len(unused)} unused compression dictionaries")
+
+    def reload(self) -> None:
+        """Set up the zstd compressor with the newest dictionary, if any. Called at the start of each run."""
+        if self.method != 'zstd':
+            return
+        row = self.conn.execute("SELECT id FROM compression_dicts ORDER BY id DESC LIMIT 1").fetchone()
+        with self._lock:
+            if row:
+                self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=self._dictionary(row[0]))
+                self._compressor_dict_id = row[0]
+            else:
+                self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+                self._compressor_dict_id = 0
+
+    def _dictionary(self, dict_id: int) -> 'zstandard.ZstdCompressionDict':
+        if dict_id not in self._dicts:
+            row = self.conn.execute("SELECT dict FROM compression_dicts WHERE id=?", (dict_id,)).fetchone()
+            if row is None:
+                raise ValueError(f"Compression dictionary {dict_id} is missing")
+            self._dicts[dict_id] = zstandard.ZstdCompressionDict(row[0])
+        return self._dicts[dict_id]
+
+    def _decompressor(self, dict_id: int) -> 'zstandard.ZstdDecompressor':
+        if dict_id not in self._decompressors:
+            if dict_id:
+                self._decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=self._dictionary(dict_id))
+            else:
+                self._decompressors[dict_id] = zstandard.ZstdDecompressor()
+        return self._decompressors[dict_id]
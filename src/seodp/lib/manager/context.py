@@ -0,0 +1,105 @@
+"""Shared services for the SEO Data Platform managers."""
+
+import threading
+from functools import wraps
+
+from settings import Config
+
+
+def service(builder):
+    """
+    A property built once per context and then reused, like functools.cached_property.
+
+    Since Python 3.12 cached_property has no lock, and services can first be asked
+    for from worker threads, so building is guarded by the context's lock. It is
+    reentrant because services build the services they depend on.
+    """
+    name = builder.__name__
+
+    @wraps(builder)
+    def get(self):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            pass
+        with self._lock:
+            if name not in self.__dict__:
+                self.__dict__[name] = builder(self)
+            return self.__dict__[name]
+
+    return property(get)
+
+
+class ServiceContext:
+    """
+    Holds the resources shared by the managers for the lifetime of the process.
+
+    Every service is built the first time a code path asks for it and is then
+    reused, so there is a single database connection, Gemini client and set of
+    extractors, and commands that don't need them never construct them.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self._lock = threading.RLock()
+
+    def close(self) -> None:
+        """Shut down the services that hold worker threads or processes, if they were built."""
+        if 'extractor_tools' in self.__dict__:
+            self.extractor_tools.shutdown()
+
+    @service
+    def response_cache(self):
+        """On-disk cache of extractor responses, or None when caching is disabled."""
+        if not self.config.cache_enabled:
+            return None
+        from lib.cache import DiskCache
+        return DiskCache(self.config.cache_dir / 'responses', self.config.cache_max_mb * 1024 * 1024)
+
+    @service
+    def llm_cache(self):
+        """On-disk cache of Gemini responses, or None when caching is disabled."""
+        if not self.config.cache_enabled:
+            return None
+        from lib.cache import DiskCache
+        return DiskCache(self.config.cache_dir / 'llm', self.config.llm_cache_max_mb * 1024 * 1024)
+
+    @service
+    def extractor_tools(self):
+        from lib.extractors import ExtractorTools
+        return ExtractorTools(self.config, cache=self.response_cache)
+
+    @service
+    def llm_telemetry(self):
+        from lib.api.telemetry import LLMTelemetry
+        return LLMTelemetry(self.config.gemini_input_cost_per_million, self.config.gemini_output_cost_per_million)
+
+    @service
+    def gemini_client(self):
+        from lib.api.gemini import GeminiAPIClient
+        return GeminiAPIClient(self.config, cache=self.llm_cache, telemetry=self.llm_telemetry)
+
+    @service
+    def data_manager(self):
+        from lib.manager.data import DataManager
+        return DataManager(self.config, self)
+
+    @service
+    def llm_manager(self):
+        from lib.manager.llm import LLMManager
+        return LLMManager(self.config, self)
+
+    @service
+    def url_manager(self):
+        from lib.manager.url import URLManager
+        return URLManager(self.config, self)
+
+    @service
+    def aggregation_manager(self):
+        from lib.manager.aggregation import AggregationManager
+        return AggregationManager(self.config)
+
+    @service
+    def email_handler(self):
+        from lib.api.email import EmailHandler
+        return EmailHandler(self.config)
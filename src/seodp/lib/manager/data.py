@@ -1,16 +1,25 @@
 """Data manager module for SEO Data Platform."""
 
+from collections import OrderedDict
 from datetime import datetime, timedelta, date
-from typing import Dict, Any, List, NamedTuple
+from functools import cached_property
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Set, Tuple
 import sqlite3
 import json
-from lib.api.gemini import GeminiAPIClient
-from lib.extractors import ExtractorTools
+import threading
+import time
+from lib.manager.codec import BlobCodec
+from lib.manager.context import ServiceContext
 from loguru import logger
 
 from settings import Config
 
 
+# Rows sampled to train the compression dictionary, and rows rewritten per transaction, by compact_database.
+COMPACT_SAMPLE_ROWS = 2000
+COMPACT_BATCH_ROWS = 500
+
+
 class Period(NamedTuple):
     year: int
     period: int
@@ -18,19 +27,114 @@ class Period(NamedTuple):
     end: str
 
 class DataManager:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, context: Optional[ServiceContext] = None):
         self.config = config
+        self.context = context or ServiceContext(config)
         self.db_file = config.db_file
-        self.conn = sqlite3.connect(self.db_file)
-        self.gemini_client = GeminiAPIClient(config)
-        self.extractor_tools = ExtractorTools(config)
-        self.setup_database()
-
-    def setup_database(self) -> None:
-        self.conn.execute('''CREATE TABLE IF NOT EXISTS data
-                         (url TEXT, year INTEGER, period INTEGER, start_date TEXT, end_date TEXT, data TEXT, insights TEXT)''')
-        self.conn.execute('''CREATE TABLE IF NOT EXISTS excluded_urls
+        self._excluded_urls: Optional[Set[str]] = None
+        self._url_aliases: Optional[Dict[str, str]] = None
+        # Write-behind buffers for data and page_state rows, keyed like their primary keys.
+        self._pending_data: Dict[Tuple[str, int, int], Tuple] = OrderedDict()
+        self._pending_states: Dict[str, Tuple] = OrderedDict()
+        self._pending_lock = threading.RLock()
+        self._last_flush = time.monotonic()
+
+    @cached_property
+    def conn(self) -> sqlite3.Connection:
+        # The scheduler runs jobs on its own threads; a run only uses the connection from one thread at a time.
+        conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        # WAL lets readers (reports, --url_test) run while a run is writing, and with WAL
+        # synchronous=NORMAL is still safe against corruption, only the last commits can be lost on power failure.
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-65536")
+        self.setup_database(conn)
+        return conn
+
+    @cached_property
+    def codec(self) -> BlobCodec:
+        return BlobCodec(self.conn, self.config.db_compression)
+
+    @property
+    def extractor_tools(self):
+        return self.context.extractor_tools
+
+    def setup_database(self, conn: sqlite3.Connection) -> None:
+        conn.execute('''CREATE TABLE IF NOT EXISTS data
+                         (url TEXT NOT NULL, year INTEGER NOT NULL, period INTEGER NOT NULL, start_date TEXT, end_date TEXT, data TEXT, insights TEXT,
+                          organic_sessions REAL, PRIMARY KEY (url, year, period))''')
+        self._migrate_data_primary_key(conn)
+        self._migrate_organic_sessions(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS data_year_period ON data (year, period)")
+        conn.execute('''CREATE TABLE IF NOT EXISTS excluded_urls
                          (url TEXT, exclusion_date TEXT, reason TEXT)''')
+        self._migrate_excluded_urls_unique(conn)
+        conn.execute('''CREATE TABLE IF NOT EXISTS url_aliases
+                         (alias TEXT PRIMARY KEY, url TEXT NOT NULL, seen_date TEXT)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS page_state
+                         (url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, lastmod TEXT, content_hash TEXT, checked_date TEXT)''')
+
+    @staticmethod
+    def _migrate_data_primary_key(conn: sqlite3.Connection) -> None:
+        """Rebuild a `data` table created without a primary key, keeping the latest row for each (url, year, period)."""
+        columns = conn.execute("PRAGMA table_info(data)").fetchall()
+        if any(column[5] for column in columns):
+            return
+
+        before = conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+        with conn:
+            conn.execute("BEGIN")
+            conn.execute('''CREATE TABLE data_migrated
+                             (url TEXT NOT NULL, year INTEGER NOT NULL, period INTEGER NOT NULL, start_date TEXT, end_date TEXT, data TEXT, insights TEXT,
+                              PRIMARY KEY (url, year, period))''')
+            # INSERT OR REPLACE never replaced anything without a key, so the last row written is the current one.
+            conn.execute('''INSERT INTO data_migrated
+                             SELECT url, year, period, start_date, end_date, data, insights FROM data
+                             WHERE rowid IN (SELECT MAX(rowid) FROM data WHERE url IS NOT NULL AND year IS NOT NULL AND period IS NOT NULL
+                                             GROUP BY url, year, period)''')
+            conn.execute("DROP TABLE data")
+            conn.execute("ALTER TABLE data_migrated RENAME TO data")
+        after = conn.execute("SELECT COUNT(*) FROM data").fetchone()[0]
+        logger.info(f"Added a primary key to the data table, removing {before - after} duplicate rows")
+        conn.execute("VACUUM")
+
+    @staticmethod
+    def _migrate_organic_sessions(conn: sqlite3.Connection) -> None:
+        """Add the organic_sessions column to older databases and fill it from the stored GA4 payloads."""
+        columns = [column[1] for column in conn.execute("PRAGMA table_info(data)").fetchall()]
+        if 'organic_sessions' in columns:
+            return
+
+        with conn:
+            conn.execute("ALTER TABLE data ADD COLUMN organic_sessions REAL")
+            conn.execute('''UPDATE data SET organic_sessions =
+                             CASE WHEN COALESCE(json_extract(data, '$.data.GA4Extractor'), '{}') = '{}' THEN NULL
+                                  ELSE COALESCE(CAST(json_extract(data, '$.data.GA4Extractor.organic_sessions') AS REAL), 0)
+                             END''')
+        logger.info("Added the organic_sessions column to the data table")
+
+    @staticmethod
+    def _migrate_excluded_urls_unique(conn: sqlite3.Connection) -> None:
+        """Remove duplicate exclusions, keeping the first, and make url unique."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='excluded_urls_url'").fetchone():
+            return
+
+        with conn:
+            conn.execute("DELETE FROM excluded_urls WHERE rowid NOT IN (SELECT MIN(rowid) FROM excluded_urls GROUP BY url)")
+            conn.execute("CREATE UNIQUE INDEX excluded_urls_url ON excluded_urls (url)")
+
+    @staticmethod
+    def _organic_sessions(data: Dict[str, Any]) -> Optional[float]:
+        """Organic sessions from a stored payload: None if GA4 returned nothing, 0 if it had no organic rows."""
+        ga4 = data.get('data', {}).get('GA4Extractor')
+        if not ga4:
+            return None
+        try:
+            return float(ga4.get('organic_sessions') or 0)
+        except (TypeError, ValueError):
+            return None
 
     def get_current_period(self) -> Period:
         today = date.today()
@@ -78,54 +182,201 @@ class DataManager:
         prior_period = self.get_prior_period()
         return self._get_data(url, prior_period.year, prior_period.period)
 
-    def get_current_data_live(self, url: str) -> Dict[str, Any]:
+    def get_current_data_live(self, url: str, reuse: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
         current_period = self.get_current_period()
-        return self._extract_data(url, current_period)
+        return self._extract_data(url, current_period, reuse)
 
-    def get_prior_data_live(self, url: str) -> Dict[str, Any]:
+    def get_prior_data_live(self, url: str, reuse: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
         prior_period = self.get_prior_period()
-        return self._extract_data(url, prior_period)
+        return self._extract_data(url, prior_period, reuse)
+
+    def get_page_state(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._pending_lock:
+            row = self._pending_states.get(url)
+        if row:
+            row = row[1:]
+        else:
+            c = self.conn.execute("SELECT etag, last_modified, lastmod, content_hash FROM page_state WHERE url=?", (url,))
+            row = c.fetchone()
+        if not row:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'lastmod': row[2], 'content_hash': row[3]}
+
+    def store_page_state(self, url: str, state: Dict[str, Any]) -> None:
+        checked_date = datetime.now().strftime('%Y-%m-%d')
+        row = (url, state.get('etag'), state.get('last_modified'), state.get('lastmod'), state.get('content_hash'), checked_date)
+        with self._pending_lock:
+            self._pending_states[url] = row
+            self.flush_if_due()
+
+    def revalidate_page(self, url: str, state: Optional[Dict[str, Any]], lastmod: Optional[str] = None) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Check a page against the validators from the previous run. Returns (unchanged, new state)."""
+        return self.extractor_tools.revalidate(url, state, lastmod)
+
+    def prefetch(self, period: Period) -> None:
+        self.extractor_tools.prefetch(period.start, period.end)
 
     def _get_data(self, url: str, year: int, period: int) -> Dict[str, Any]:
+        with self._pending_lock:
+            row = self._pending_data.get((url, year, period))
+        if row:
+            return json.loads(self.codec.decode(row[5]))
         c = self.conn.execute("SELECT data FROM data WHERE url=? AND year=? AND period=?", (url, year, period))
         data = c.fetchone()
-        return json.loads(data[0]) if data else {}
+        return json.loads(self.codec.decode(data[0])) if data else {}
+
+    def _extract_data(self, url: str, period: Period, reuse: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
+        data, failed = self.extractor_tools.extract_data(url, period.start, period.end, reuse=reuse)
+        attribution = {'url': url, 'date_range': f"{period.start} to {period.end}"}
+        if failed:
+            attribution['failed_sources'] = failed
+        return {'data_attribution': attribution, 'data': data}
 
-    def _extract_data(self, url: str, period: Period) -> Dict[str, Any]:
-        data = self.extractor_tools.extract_data(url, period.start, period.end)
-        return {'data_attribution': {'url': url, 'date_range': f"{period.start} to {period.end}"}, 'data': data}
+    @staticmethod
+    def failed_sources(data: Dict[str, Any]) -> List[str]:
+        """
+        The sources that failed to extract for a stored payload. Rows written before
+        failures were recorded hold an empty dictionary for a failed source.
+        """
+        failed = list(data.get('data_attribution', {}).get('failed_sources', []))
+        failed += [name for name, payload in data.get('data', {}).items() if payload == {} and name not in failed]
+        return failed
 
     def store_data(self, url: str, period: Period, data: Dict[str, Any], insights: Dict[str, Any]) -> None:
-        data_json = json.dumps(data)
-        insights_json = json.dumps(insights)
-        with self.conn:
-            self.conn.execute("INSERT OR REPLACE INTO data (url, year, period, start_date, end_date, data, insights) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                             (url, period.year, period.period, period.start, period.end, data_json, insights_json))
+        """Queue a data row for writing. Rows are written in batches by flush()."""
+        data_json = self.codec.encode(json.dumps(data))
+        insights_json = self.codec.encode(json.dumps(insights))
+        row = (url, period.year, period.period, period.start, period.end, data_json, insights_json, self._organic_sessions(data))
+        with self._pending_lock:
+            self._pending_data[(url, period.year, period.period)] = row
+            self.flush_if_due()
+
+    def flush(self) -> None:
+        """
+        Write all queued rows in a single transaction.
+
+        The batch commits as a whole or not at all, and rows are upserted on their
+        primary keys, so a crash never leaves a partial batch and writing a row
+        again is harmless. Rows still queued at a crash are lost, and their URLs
+        are processed again on the next run. The URL pipeline calls flush_if_due
+        at least every db_flush_interval seconds, so at most db_batch_size rows,
+        or db_flush_interval seconds of results, are lost.
+        """
+        with self._pending_lock:
+            if not self._pending_data and not self._pending_states:
+                self._last_flush = time.monotonic()
+                return
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO data (url, year, period, start_date, end_date, data, insights, organic_sessions) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      list(self._pending_data.values()))
+                self.conn.executemany("INSERT OR REPLACE INTO page_state (url, etag, last_modified, lastmod, content_hash, checked_date) VALUES (?, ?, ?, ?, ?, ?)",
+                                      list(self._pending_states.values()))
+            logger.debug(f"Wrote {len(self._pending_data)} data rows and {len(self._pending_states)} page states")
+            self._pending_data.clear()
+            self._pending_states.clear()
+            self._last_flush = time.monotonic()
+
+    def flush_if_due(self) -> None:
+        """Flush once db_batch_size rows are queued or db_flush_interval seconds have passed since the last flush."""
+        with self._pending_lock:
+            if (len(self._pending_data) + len(self._pending_states) >= self.config.db_batch_size
+                    or time.monotonic() - self._last_flush >= self.config.db_flush_interval):
+                self.flush()
 
     def get_all_insights(self, year: int, period: int) -> List[Dict[str, Any]]:
+        self.flush()
         c = self.conn.execute("SELECT url, insights FROM data WHERE year=? AND period=?", (year, period))
         results = c.fetchall()
-        return [{"url": row[0], **json.loads(row[1])} for row in results]
+        return [{"url": row[0], **json.loads(self.codec.decode(row[1]))} for row in results]
+
+    def compact_database(self) -> None:
+        """
+        Rewrite every stored row in the configured compression format.
+
+        With zstd, a dictionary is first trained on a sample of the stored data so
+        that rows, which share most of their structure, compress several times
+        better. Rows are rewritten in batches, each in its own transaction, and the
+        database file is vacuumed at the end to return the freed space.
+        """
+        self.flush()
+        size_before = self._database_size()
+
+        c = self.conn.execute("SELECT data FROM data ORDER BY RANDOM() LIMIT ?", (COMPACT_SAMPLE_ROWS,))
+        self.codec.train_dictionary([self.codec.decode(row[0]) for row in c.fetchall()])
+
+        rewritten = 0
+        last_rowid = 0
+        while True:
+            rows = self.conn.execute("SELECT rowid, data, insights FROM data WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                     (last_rowid, COMPACT_BATCH_ROWS)).fetchall()
+            if not rows:
+                break
+            with self.conn:
+                self.conn.executemany("UPDATE data SET data=?, insights=? WHERE rowid=?", [
+                    (self.codec.encode(self.codec.decode(data)), self.codec.encode(self.codec.decode(insights)), rowid)
+                    for rowid, data, insights in rows
+                ])
+            rewritten += len(rows)
+            last_rowid = rows[-1][0]
+
+        self.codec.drop_unused_dictionaries()
+        self.conn.execute("VACUUM")
+        size_after = self._database_size()
+        logger.info(f"Compacted {rewritten} rows: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+    def _database_size(self) -> int:
+        page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def load_excluded_urls(self) -> Set[str]:
+        """Read the excluded URLs into memory. Called at the start of each run."""
+        self._excluded_urls = {row[0] for row in self.conn.execute("SELECT url FROM excluded_urls")}
+        return self._excluded_urls
 
     def is_url_excluded_from_processing(self, url: str) -> bool:
-        c = self.conn.execute("SELECT 1 FROM excluded_urls WHERE url=?", (url,))
-        result = c.fetchone()
-        return bool(result)
+        """Whether a URL, or the URL it is an alias of, is excluded."""
+        if self._excluded_urls is None:
+            self.load_excluded_urls()
+        if url in self._excluded_urls:
+            return True
+        return self.load_url_aliases().get(url) in self._excluded_urls
+
+    def load_url_aliases(self) -> Dict[str, str]:
+        """The URL variants seen on earlier runs, mapped to the URL they were processed and stored as."""
+        if self._url_aliases is None:
+            self._url_aliases = dict(self.conn.execute("SELECT alias, url FROM url_aliases"))
+        return self._url_aliases
+
+    def store_url_aliases(self, aliases: Dict[str, List[str]]) -> None:
+        """Record the variants seen for each processed URL, so later runs map them back to it."""
+        seen_date = datetime.now().strftime('%Y-%m-%d')
+        with self.conn:
+            # A URL processed under its own name is no longer an alias of another.
+            self.conn.executemany("DELETE FROM url_aliases WHERE alias=?", ((url,) for url in aliases))
+            self.conn.executemany("INSERT OR REPLACE INTO url_aliases (alias, url, seen_date) VALUES (?, ?, ?)",
+                                  ((alias, url, seen_date) for url, variants in aliases.items() for alias in variants))
+        self._url_aliases = None
+
+    def exclude_low_traffic_urls_from_processing(self, urls: Iterable[str]) -> None:
+        """Exclude the URLs whose organic sessions this period are below low_traffic_threshold.
 
-    def exclude_low_traffic_urls_from_processing(self, urls: List[str]) -> None:
+        URLs without GA4 data for the period (not processed, or GA4 failed) are left alone.
+        """
+        self.flush()
         current_period = self.get_current_period()
-        low_traffic_threshold = self.config.low_traffic_threshold
-
-        for url in urls:
-            c = self.conn.execute("SELECT data FROM data WHERE url=? AND year=? AND period=?", (url, current_period.year, current_period.period))
-            latest_data = c.fetchone()
-            if latest_data:
-                data = json.loads(latest_data[0])
-                if data.get('GA4Extractor', {}).get('organic_sessions', 0) < low_traffic_threshold:
-                    logger.info(f"Excluding {url} due to low traffic")
-                    self._add_url_to_excluded_list(url, "Low traffic")
-
-    def _add_url_to_excluded_list(self, url: str, reason: str) -> None:
         exclusion_date = datetime.now().strftime('%Y-%m-%d')
+        previously_excluded = self.load_excluded_urls()
+
         with self.conn:
-            self.conn.execute("INSERT INTO excluded_urls (url, exclusion_date, reason) VALUES (?, ?, ?)", (url, exclusion_date, reason))
\ No newline at end of file
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS run_urls (url TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM run_urls")
+            self.conn.executemany("INSERT OR IGNORE INTO run_urls (url) VALUES (?)", ((url,) for url in urls))
+            self.conn.execute('''INSERT OR IGNORE INTO excluded_urls (url, exclusion_date, reason)
+                                 SELECT data.url, ?, 'Low traffic' FROM data JOIN run_urls ON run_urls.url = data.url
+                                 WHERE data.year=? AND data.period=? AND data.organic_sessions < ?''',
+                              (exclusion_date, current_period.year, current_period.period, self.config.low_traffic_threshold))
+            self.conn.execute("DELETE FROM run_urls")
+
+        for url in sorted(self.load_excluded_urls() - previously_excluded):
+            logger.info(f"Excluding {url} due to low traffic")
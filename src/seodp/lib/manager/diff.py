@@ -0,0 +1,92 @@
+"""Deterministic comparison of current and prior extractor payloads."""
+
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from lib.manager.prompt import extractor_payloads
+from settings import Config, MetricThreshold
+
+_MISSING = object()
+
+
+class MetricChange(NamedTuple):
+    path: str
+    prior: Any
+    current: Any
+
+
+def _lookup(data: Dict[str, Any], path: str) -> Any:
+    """Follow a dotted path like 'GA4Extractor.organic_sessions' through nested dictionaries."""
+    value = data
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return _MISSING
+        value = value[key]
+    return _MISSING if value is None else value
+
+
+def _to_number(value: Any) -> Optional[float]:
+    # GA4 returns metric values as strings.
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_significant(prior: float, current: float, threshold: MetricThreshold) -> bool:
+    """Whether a change meets every bound of the threshold. A threshold with no bounds matches any change."""
+    delta = abs(current - prior)
+    if delta == 0:
+        return False
+    if threshold.absolute is not None and delta < threshold.absolute:
+        return False
+    if threshold.relative is not None and prior != 0 and delta / abs(prior) * 100 < threshold.relative:
+        return False
+    return True
+
+
+class ChangeDetector:
+    """
+    Finds the metrics that changed significantly between two periods of a URL.
+
+    Numeric metrics are compared against `prescreen_thresholds`, and any change to
+    a field in `prescreen_watch_fields` counts. Paths start at the extractor name.
+    A metric that is missing from either period (its extractor failed or returned
+    nothing) is not compared.
+    """
+
+    def __init__(self, config: Config):
+        self.thresholds = config.prescreen_thresholds
+        self.watch_fields = config.prescreen_watch_fields
+
+    def significant_changes(self, current_data: Dict[str, Any], prior_data: Dict[str, Any]) -> Optional[List[MetricChange]]:
+        """
+        Compare the payloads of two periods.
+
+        Returns:
+            Optional[List[MetricChange]]: The significant changes, or None if no metric
+            could be compared at all, in which case the URL shouldn't be skipped.
+        """
+        current = extractor_payloads(current_data)
+        prior = extractor_payloads(prior_data)
+        changes = []
+        compared = 0
+
+        for path, threshold in self.thresholds.items():
+            current_value = _to_number(_lookup(current, path))
+            prior_value = _to_number(_lookup(prior, path))
+            if current_value is None or prior_value is None:
+                continue
+            compared += 1
+            if is_significant(prior_value, current_value, threshold):
+                changes.append(MetricChange(path, prior_value, current_value))
+
+        for path in self.watch_fields:
+            current_value = _lookup(current, path)
+            prior_value = _lookup(prior, path)
+            if current_value is _MISSING or prior_value is _MISSING:
+                continue
+            compared += 1
+            if current_value != prior_value:
+                changes.append(MetricChange(path, prior_value, current_value))
+
+        return changes if compared else None
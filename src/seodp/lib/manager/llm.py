@@ -1,18 +1,35 @@
 """LLM module for SEO Data Platform with configurable topics and significance threshold."""
 
 import json
-from typing import Dict, Any, List
-from lib.api.gemini import GeminiAPIClient
+from typing import Dict, Any, List, Optional, Tuple
+from loguru import logger
+from lib.exceptions import GeminiAPIError, TokenBudgetExceeded
+from lib.manager.context import ServiceContext
+from lib.manager.prompt import PromptCompactor, dumps, estimate_tokens
 
 from settings import Config
 
+COMPACT_DATA_FORMAT = """- metrics: "Source.field": [prior, current, change, change %]. Change fields are omitted when the value didn't move, and null means no data.
+        - lists: for keyword, page, demographic and referral lists, only the entries that were added or removed, and [prior, current] values of changed entries.
+        - metadata: page metadata fields that changed, as [prior, current].
+        - content: "unchanged", or a word-level diff of the page content (punctuation removed) with the similarity ratio of the two versions."""
+INSIGHT_FIELDS = ("description", "importance_score", "current_value", "prior_value", "details")
+# Output tokens allowed per URL in a batch, and Gemini's limit for a whole response.
+BATCH_OUTPUT_TOKENS_PER_URL = 2048
+MAX_OUTPUT_TOKENS = 8192
+
 
 class LLMManager:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, context: Optional[ServiceContext] = None):
         self.config = config
-        self.gemini_client = GeminiAPIClient(config)
+        self.context = context or ServiceContext(config)
         self.report_topics = config.report_topics
         self.significance_threshold = config.report_significance_threshold
+        self.compactor = PromptCompactor(config.prompt_token_budget, config.prompt_content_diff_chars)
+
+    @property
+    def gemini_client(self):
+        return self.context.gemini_client
 
     def generate_structured_insights(self, current_data: Dict[str, Any], prior_data: Dict[str, Any]) -> Dict[str, Any]:
         """Generates structured insights based on configured topics and significance threshold."""
@@ -20,16 +37,162 @@ class LLMManager:
         response_schema = self._create_response_schema()
 
         # Generate insights using Gemini API
-        response = self.gemini_client.generate_content(prompt, response_schema=response_schema)
+        url = (current_data or {}).get('data_attribution', {}).get('url')
+        response = self.gemini_client.generate_content(prompt, response_schema=response_schema, label=url, validate=json.loads)
         insights = json.loads(response)
         
-        # Calculate change_percentage and change_absolute for each insight
+        return self._add_changes(insights)
+
+    def generate_batch_insights(self, items: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        Generate insights for several URLs, packing them into as few requests as possible.
+
+        Each request holds up to llm_batch_size URLs (at most 4) whose compacted data fits in
+        llm_batch_token_budget estimated tokens, under short ids, with a response
+        schema keyed by those ids. URLs missing from a batch response or with
+        invalid insights, and all URLs of a failed batch, are retried one by one.
+
+        Failures don't discard the insights already generated: a URL whose retry
+        fails gets skipped insights flagged 'generation_failed', and once the run's
+        token budget is spent, the URLs not done yet are flagged 'token_budget_exceeded'.
+
+        Args:
+            items (List[Tuple[Dict, Dict]]): (current_data, prior_data) for each URL.
+
+        Returns:
+            List[Dict[str, Any]]: The insights for each URL, in the order of `items`.
+        """
+        compacted = [dumps(self.compactor.compact(current, prior)) for current, prior in items]
+        urls = [(current or {}).get('data_attribution', {}).get('url') for current, _ in items]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        budget_exceeded = False
+
+        for batch in self._pack_batches(compacted):
+            batch_insights = {}
+            if len(batch) > 1 and not budget_exceeded:
+                try:
+                    batch_insights = self._generate_batch(batch, compacted, urls)
+                except TokenBudgetExceeded as e:
+                    logger.warning(f"Skipping insights for the remaining URLs of the batch: {e}")
+                    budget_exceeded = True
+                except (GeminiAPIError, ValueError) as e:
+                    logger.warning(f"Batch of {len(batch)} URLs failed, retrying them one by one: {e}")
+
+            for index in batch:
+                insights = batch_insights.get(index)
+                if insights is None and not budget_exceeded:
+                    try:
+                        insights = self.generate_structured_insights(*items[index])
+                    except TokenBudgetExceeded as e:
+                        logger.warning(f"Skipping insights for the remaining URLs of the batch: {e}")
+                        budget_exceeded = True
+                    except (GeminiAPIError, ValueError) as e:
+                        logger.error(f"Error generating insights for {urls[index]}: {e}")
+                        insights = self.skipped_insights('generation_failed')
+                results[index] = insights or self.skipped_insights('token_budget_exceeded')
+
+        return results
+
+    def start_run(self) -> None:
+        """Reset the LLM usage telemetry and token budget for a new run."""
+        self.gemini_client.start_run()
+
+    def no_change_insights(self) -> Dict[str, Any]:
+        """The insights recorded, without calling the LLM, for a URL with no significant changes."""
+        return self.skipped_insights('no_material_change')
+
+    def skipped_insights(self, reason: str) -> Dict[str, Any]:
+        """Empty insights for a URL that wasn't sent to the LLM, flagged with the reason."""
+        insights = {topic.lower().replace(' ', '_'): [] for topic in self.report_topics}
+        insights[reason] = True
+        return insights
+
+    def _pack_batches(self, compacted: List[str]) -> List[List[int]]:
+        """
+        Group item indexes into batches bounded by llm_batch_size and llm_batch_token_budget.
+
+        A batch never holds more URLs than fit in Gemini's output limit, since a
+        truncated response would fail to parse and every URL would be sent again.
+        """
+        max_size = min(self.config.llm_batch_size, MAX_OUTPUT_TOKENS // BATCH_OUTPUT_TOKENS_PER_URL)
+        batches, batch, batch_tokens = [], [], 0
+        for index, data in enumerate(compacted):
+            tokens = estimate_tokens(data)
+            if batch and (len(batch) >= max_size
+                          or batch_tokens + tokens > self.config.llm_batch_token_budget):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(index)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _generate_batch(self, batch: List[int], compacted: List[str], urls: List[Optional[str]]) -> Dict[int, Dict[str, Any]]:
+        """Request insights for a batch of URLs. Returns the valid insights by item index.
+
+        Usage is recorded under each URL, with an even share of the batch's tokens.
+        """
+        ids = {f"u{position + 1}": index for position, index in enumerate(batch)}
+        single_schema = self._create_response_schema()
+        response_schema = {
+            "type": "object",
+            "properties": {url_id: single_schema for url_id in ids},
+            "required": list(ids)
+        }
+        data = "\n".join(f"{url_id}: {compacted[index]}" for url_id, index in ids.items())
+        prompt = f"""
+        Analyze the following changes in SEO data for {len(ids)} URLs between a prior and a current period and provide insights on the specified topics for each URL separately.
+
+        The data for each URL is JSON, on its own line after the URL's id:
+        {COMPACT_DATA_FORMAT}
+
+        Data:
+        {data}
+
+        Answer with an object keyed by URL id. {self._insight_instructions()}
+        """
+
+        response = self.gemini_client.generate_content(
+            prompt, response_schema=response_schema,
+            max_output_tokens=BATCH_OUTPUT_TOKENS_PER_URL * len(ids),
+            label=[urls[index] for index in batch if urls[index]], validate=json.loads
+        )
+        batch_insights = json.loads(response)
+        if not isinstance(batch_insights, dict):
+            raise ValueError("Batch response is not an object")
+
+        results = {}
+        for url_id, index in ids.items():
+            insights = batch_insights.get(url_id)
+            if self._is_valid(insights):
+                results[index] = self._add_changes(insights)
+            else:
+                logger.warning(f"Invalid or missing insights for {url_id} in batch response")
+        return results
+
+    def _is_valid(self, insights: Any) -> bool:
+        """Whether insights match the response schema: a list of complete insights for every topic."""
+        if not isinstance(insights, dict):
+            return False
+        for topic in self.report_topics:
+            topic_insights = insights.get(topic.lower().replace(' ', '_'))
+            if not isinstance(topic_insights, list):
+                return False
+            for insight in topic_insights:
+                if not isinstance(insight, dict) or any(field not in insight for field in INSIGHT_FIELDS):
+                    return False
+                if not all(isinstance(insight[field], (int, float)) for field in ("importance_score", "current_value", "prior_value")):
+                    return False
+        return True
+
+    def _add_changes(self, insights: Dict[str, Any]) -> Dict[str, Any]:
+        """Calculate change_percentage and change_absolute for each insight."""
         for topic in insights:
             for insight in insights[topic]:
                 if 'prior_value' in insight and 'current_value' in insight:
                     insight['change_percentage'] = self._calculate_change_percentage(insight['prior_value'], insight['current_value'])
                     insight['change_absolute'] = insight['current_value'] - insight['prior_value']
-        
         return insights
 
     def _calculate_change_percentage(self, prior_value: float, current_value: float) -> float:
@@ -40,6 +203,9 @@ class LLMManager:
 
     def _create_insight_prompt(self, current_data: Dict[str, Any], prior_data: Dict[str, Any]) -> str:
         """Creates a prompt for the Gemini API to generate targeted SEO insights."""
+        if self.config.compact_prompts:
+            return self._create_compact_insight_prompt(current_data, prior_data)
+
         prompt = f"""
         Analyze the following SEO data and provide insights on the specified topics:
 
@@ -63,6 +229,35 @@ class LLMManager:
         """
         return prompt
 
+    def _create_compact_insight_prompt(self, current_data: Dict[str, Any], prior_data: Dict[str, Any]) -> str:
+        """Creates the prompt from the compacted changes between the periods instead of both full payloads."""
+        prompt = f"""
+        Analyze the following changes in SEO data for a URL between a prior and a current period and provide insights on the specified topics.
+
+        The data is JSON:
+        {COMPACT_DATA_FORMAT}
+
+        Data:
+        {dumps(self.compactor.compact(current_data, prior_data))}
+
+        {self._insight_instructions()}
+        """
+        return prompt
+
+    def _insight_instructions(self) -> str:
+        """The topics and guidance shared by the compact single-URL and batch prompts."""
+        return f"""Focus on the following topics and provide detailed insights:
+
+        {self._format_topics()}
+
+        For each insight:
+        - Provide specific data points for both current and prior periods
+        - Assign an importance score (0-100) based on the potential impact of the change
+        - Provide clear, actionable details about the change
+        - Focus on significant changes in absolute values or clear trends
+
+        Ensure all conclusions are strongly supported by the data provided. Focus on changes that have a substantial impact on the URL's performance."""
+
     def _format_topics(self) -> str:
         """Formats the report topics for the prompt."""
         return "\n".join(f"- {topic}" for topic in self.report_topics)
@@ -0,0 +1,233 @@
+"""Compact, delta-oriented representation of a URL's data for LLM prompts."""
+
+import difflib
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+# Rough characters per token for English text and JSON, used to budget prompts without an API call.
+CHARS_PER_TOKEN = 4
+
+# Keyed lists in extractor payloads: the fields identifying an entry, and its numeric fields.
+LIST_KEYS = {
+    'ranking_keywords': (('query',), ('clicks', 'impressions', 'ctr', 'position')),
+    'pages_visited_prior': (('page',), ('views',)),
+    'pages_visited_next': (('page',), ('views',)),
+    'user_demographics': (('age', 'gender', 'country'), ('users',)),
+}
+# Metadata that changes on every extraction without the page changing.
+IGNORED_METADATA = {'fingerprint', 'filedate', 'id'}
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def dumps(value: Any) -> str:
+    """Minified JSON."""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def extractor_payloads(data: Dict[str, Any]) -> Dict[str, Any]:
+    """The per-extractor payloads of a stored period, which may or may not be wrapped with its data_attribution."""
+    data = data or {}
+    return data['data'] if isinstance(data.get('data'), dict) else data
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        # GA4 returns metric values as strings.
+        for parse in (int, float):
+            try:
+                return parse(value)
+            except ValueError:
+                pass
+    return None
+
+
+def _round(value: float) -> float:
+    return round(value, 4) if isinstance(value, float) else value
+
+
+class PromptCompactor:
+    """
+    Turns the current and prior payloads of a URL into one compact structure.
+
+    Instead of both payloads in full, the result holds:
+
+    - metrics: every numeric value as [prior, current, change, change %], with
+      the change fields only when the value moved
+    - lists: for keyword, page and demographic lists, only the entries that were
+      added, removed or whose numbers changed; for plain lists like referring
+      sites, what was added and removed
+    - metadata: the metadata fields that changed
+    - content: 'unchanged', or a word-level diff of the page content bounded
+      to `content_diff_chars`
+
+    The whole structure is kept under `token_budget` estimated tokens by
+    shrinking the content diff first and then the list sections.
+    """
+
+    def __init__(self, token_budget: int = 6000, content_diff_chars: int = 3000):
+        self.token_budget = token_budget
+        self.content_diff_chars = content_diff_chars
+
+    def compact(self, current_data: Dict[str, Any], prior_data: Dict[str, Any]) -> Dict[str, Any]:
+        current = extractor_payloads(current_data)
+        prior = extractor_payloads(prior_data)
+
+        result = {
+            'url': (current_data or {}).get('data_attribution', {}).get('url'),
+            'current_period': (current_data or {}).get('data_attribution', {}).get('date_range'),
+            'prior_period': (prior_data or {}).get('data_attribution', {}).get('date_range'),
+            'metrics': {},
+            'lists': {},
+            'metadata': {},
+        }
+
+        for source in sorted(set(current) | set(prior)):
+            current_source = current.get(source) or {}
+            prior_source = prior.get(source) or {}
+            if not isinstance(current_source, dict) or not isinstance(prior_source, dict):
+                continue
+            self._compare(source, current_source, prior_source, result)
+
+        current_content = (current.get('URLExtractor') or {}).get('clean_content') or ''
+        prior_content = (prior.get('URLExtractor') or {}).get('clean_content') or ''
+        return self._fit_budget(result, current_content, prior_content)
+
+    def _compare(self, path: str, current: Dict[str, Any], prior: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Walk two payload dictionaries side by side, filling in the sections of `result`."""
+        for key in sorted(set(current) | set(prior)):
+            current_value, prior_value = current.get(key), prior.get(key)
+            field = f"{path}.{key}"
+
+            if key in ('clean_content', 'schema_markup'):
+                continue
+            if key == 'metadata':
+                self._compare_metadata(current_value or {}, prior_value or {}, result)
+            elif isinstance(current_value, dict) or isinstance(prior_value, dict):
+                self._compare(field, current_value or {}, prior_value or {}, result)
+            elif isinstance(current_value, list) or isinstance(prior_value, list):
+                changes = self._compare_list(key, current_value or [], prior_value or [])
+                if changes:
+                    result['lists'][field] = changes
+            else:
+                metric = self._compare_metric(current_value, prior_value)
+                if metric is not None:
+                    result['metrics'][field] = metric
+
+    @staticmethod
+    def _compare_metric(current: Any, prior: Any) -> Optional[List]:
+        current_number, prior_number = _to_number(current), _to_number(prior)
+        if current_number is None and prior_number is None:
+            return None
+        if current_number is None or prior_number is None or current_number == prior_number:
+            return [_round(prior_number), _round(current_number)]
+        change = current_number - prior_number
+        change_pct = round(change / abs(prior_number) * 100, 1) if prior_number else None
+        return [_round(prior_number), _round(current_number), _round(change), change_pct]
+
+    @staticmethod
+    def _compare_list(key: str, current: List, prior: List) -> Optional[Dict[str, List]]:
+        if key not in LIST_KEYS:
+            current_items = [item for item in current if not isinstance(item, (dict, list))]
+            prior_items = [item for item in prior if not isinstance(item, (dict, list))]
+            added = [item for item in current_items if item not in prior_items]
+            removed = [item for item in prior_items if item not in current_items]
+            return {k: v for k, v in (('added', added), ('removed', removed)) if v} or None
+
+        id_fields, value_fields = LIST_KEYS[key]
+
+        def index(entries: List) -> Dict[Tuple, Dict]:
+            return {tuple(entry.get(f) for f in id_fields): entry for entry in entries if isinstance(entry, dict)}
+
+        current_entries, prior_entries = index(current), index(prior)
+        added, removed, changed = [], [], []
+        for entry_id, entry in current_entries.items():
+            name = ' / '.join(str(part) for part in entry_id)
+            values = {f: _to_number(entry.get(f)) for f in value_fields}
+            if entry_id not in prior_entries:
+                added.append({'id': name, **{f: _round(v) for f, v in values.items()}})
+                continue
+            prior_values = {f: _to_number(prior_entries[entry_id].get(f)) for f in value_fields}
+            if values != prior_values:
+                changed.append({'id': name, **{f: [_round(prior_values[f]), _round(values[f])] for f in value_fields}})
+        for entry_id in prior_entries:
+            if entry_id not in current_entries:
+                removed.append(' / '.join(str(part) for part in entry_id))
+
+        return {k: v for k, v in (('added', added), ('removed', removed), ('changed', changed)) if v} or None
+
+    @staticmethod
+    def _compare_metadata(current: Dict[str, Any], prior: Dict[str, Any], result: Dict[str, Any]) -> None:
+        for key in sorted(set(current) | set(prior)):
+            if key in IGNORED_METADATA:
+                continue
+            if current.get(key) != prior.get(key):
+                result['metadata'][key] = [prior.get(key), current.get(key)]
+
+    def _content_diff(self, current: str, prior: str, max_chars: int) -> Any:
+        """A word-level diff of the page content, at most `max_chars` of changed text."""
+        if current == prior:
+            return 'unchanged'
+        if max_chars <= 0:
+            return 'changed'
+        if not prior:
+            return {'prior': None, 'current_excerpt': current[:max_chars]}
+
+        current_words, prior_words = current.split(), prior.split()
+        matcher = difflib.SequenceMatcher(None, prior_words, current_words)
+        changes = []
+        used = 0
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                continue
+            change = {}
+            if i2 > i1:
+                change['removed'] = ' '.join(prior_words[i1:i2])
+            if j2 > j1:
+                change['added'] = ' '.join(current_words[j1:j2])
+            size = sum(len(text) for text in change.values())
+            if used + size > max_chars:
+                remaining = max_chars - used
+                change = {k: v[:remaining] for k, v in change.items()}
+                changes.append(change)
+                changes.append('...')
+                break
+            changes.append(change)
+            used += size
+
+        return {'similarity': round(matcher.ratio(), 3), 'changes': changes}
+
+    def _fit_budget(self, result: Dict[str, Any], current_content: str, prior_content: str) -> Dict[str, Any]:
+        """Add the content diff with whatever room is left, shrinking the list sections if needed."""
+        budget_chars = self.token_budget * CHARS_PER_TOKEN
+        while True:
+            room = budget_chars - len(dumps(result))
+            content_chars = min(self.content_diff_chars, room)
+            result['content'] = self._content_diff(current_content, prior_content, content_chars)
+            if len(dumps(result)) <= budget_chars or not self._shrink_lists(result):
+                return result
+
+    @staticmethod
+    def _shrink_lists(result: Dict[str, Any]) -> bool:
+        """Halve the longest list section. Returns False when there is nothing left to drop."""
+        longest = None
+        for field, changes in result['lists'].items():
+            for kind, entries in changes.items():
+                if len(entries) > 1 and (longest is None or len(entries) > len(result['lists'][longest[0]][longest[1]])):
+                    longest = (field, kind)
+        if longest is not None:
+            field, kind = longest
+            result['lists'][field][kind] = result['lists'][field][kind][:len(result['lists'][field][kind]) // 2]
+            return True
+        if result['lists']:
+            result['lists'].popitem()
+            return True
+        return False
@@ -1,78 +1,202 @@
 """URL Manager module."""
 
-import requests
-import xml.etree.ElementTree as ET
-from typing import Dict, Any, List
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
 from loguru import logger
-from lib.manager.data import DataManager
-from lib.manager.llm import LLMManager
+from lib.manager.context import ServiceContext
+from lib.canonical import URLCanonicalizer
+from lib.exceptions import GeminiAPIError, TokenBudgetExceeded
+from lib.manager.data import Period
+from lib.manager.diff import ChangeDetector
+from lib.sitemap import SitemapEntry, SitemapReader
 
 from settings import Config
 
 
 class URLManager:
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, context: Optional[ServiceContext] = None):
         self.config = config
-        self.data_manager = DataManager(config)
-        self.llm_manager = LLMManager(config)
+        self.context = context or ServiceContext(config)
+        self.max_concurrency = config.max_concurrency
+        self.change_detector = ChangeDetector(config)
+
+    @property
+    def data_manager(self):
+        return self.context.data_manager
+
+    @property
+    def llm_manager(self):
+        return self.context.llm_manager
 
     def process_all_urls(self) -> List[Dict[str, Any]]:
-        urls = self._get_urls()
-        all_insights = []
         current_period = self.data_manager.get_current_period()
+        # Load both periods up front: a bulk pull started lazily by one URL would run
+        # under its extractor timeout while every other URL waits on it.
+        self.data_manager.prefetch(current_period)
+        self.data_manager.prefetch(self.data_manager.get_prior_period())
+        self.data_manager.load_excluded_urls()
+        # Pick up a dictionary trained by `compact` since the last run.
+        self.data_manager.codec.reload()
 
-        for url in urls:
-
-            if not self.data_manager.is_url_excluded_from_processing(url):
-                logger.info(f"Processing {url}")
-                current_data = self.data_manager.get_current_data_live(url)
-                prior_data = self.data_manager.get_prior_data_db(url)
-                
-                if not prior_data:
-                    prior_data = self.data_manager.get_prior_data_live(url)
-                    prior_period = self.data_manager.get_prior_period()
-                    self.data_manager.store_data(url, prior_period, prior_data, {})
-                
-                insights = self.llm_manager.generate_structured_insights(current_data, prior_data)
-                self.data_manager.store_data(url, current_period, current_data, insights)
-                all_insights.append({"url": url, "insights": insights})
-            else:
-                logger.info(f"Skipping excluded URL: {url}")
+        urls = []
+        aliases: Dict[str, List[str]] = {}
+        entries = URLCanonicalizer(self.config).dedupe(self._get_urls(), aliases, self.data_manager.load_url_aliases())
+        try:
+            all_insights = self._run_pipeline(self._get_work(entries, urls), current_period)
+        finally:
+            # Keep the results of the URLs that finished, even if the run was interrupted.
+            self.data_manager.flush()
+            self.data_manager.store_url_aliases(aliases)
+
+        duplicates = sum(len(variants) for variants in aliases.values())
+        if duplicates:
+            logger.info(f"Skipped {duplicates} duplicate URL variants")
+        for result in all_insights:
+            result["aliases"] = aliases.get(result["url"], [])
 
         self.data_manager.exclude_low_traffic_urls_from_processing(urls)
 
         return all_insights
 
-    def _get_urls(self) -> List[str]:
+    def _get_work(self, entries: Iterable[SitemapEntry], urls: List[str]) -> Iterator[SitemapEntry]:
+        """Yield the sitemap entries that aren't excluded, appending every URL seen to `urls`."""
+        for entry in entries:
+            urls.append(entry.loc)
+            if self.data_manager.is_url_excluded_from_processing(entry.loc):
+                logger.info(f"Skipping excluded URL: {entry.loc}")
+                continue
+            yield entry
+
+    def _run_pipeline(self, entries: Iterable[SitemapEntry], current_period: Period) -> List[Dict[str, Any]]:
+        """Process URLs on a pool of max_concurrency workers.
+
+        Workers only do revalidation, extraction and LLM calls. Database reads and
+        writes stay on the calling thread, and results are returned in the order of `entries`.
+        Entries are consumed lazily and at most twice max_concurrency URLs are in
+        flight, so processing starts while the sitemap is still being read and
+        prior data is only loaded shortly before it is needed.
+
+        With llm_batch_size above 1, URLs that need insights are queued once
+        extracted and sent to the LLM in batches, when the queue is full or when
+        there is nothing else left to process.
+        """
+        prior_period = self.data_manager.get_prior_period()
+        batch_size = self.config.llm_batch_size
+        results: List[Optional[Dict[str, Any]]] = []
+        urls: List[str] = []
+        # Futures map to the index of their URL, or to the queued items of their LLM batch.
+        pending = {}
+        llm_queue = []
+        entries = iter(entries)
+        exhausted = False
+
+        def finish(index, current_data, prior_data, prior_is_new, insights, page_state):
+            url = urls[index]
+            if page_state:
+                self.data_manager.store_page_state(url, page_state)
+            if prior_is_new and not self.data_manager.failed_sources(prior_data):
+                self.data_manager.store_data(url, prior_period, prior_data, {})
+            self.data_manager.store_data(url, current_period, current_data, insights)
+            results[index] = {"url": url, "insights": insights}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            try:
+                while not exhausted or pending or llm_queue:
+                    while not exhausted and len(pending) < self.max_concurrency * 2:
+                        entry = next(entries, None)
+                        if entry is None:
+                            exhausted = True
+                            break
+                        url = entry.loc
+                        prior_data = self.data_manager.get_prior_data_db(url)
+                        page_state = self.data_manager.get_page_state(url) if self.config.skip_unchanged_pages else None
+                        pending[executor.submit(self._process_url, url, prior_data, page_state, entry.lastmod)] = len(results)
+                        results.append(None)
+                        urls.append(url)
+
+                    url_futures = any(not isinstance(item, list) for item in pending.values())
+                    if len(llm_queue) >= batch_size or (llm_queue and exhausted and not url_futures):
+                        batch, llm_queue = llm_queue[:batch_size], llm_queue[batch_size:]
+                        pending[executor.submit(self._generate_batch, batch)] = batch
+                    if not pending:
+                        continue
+
+                    # Wake up at least every db_flush_interval, so buffered rows are written
+                    # on time even while every worker is waiting on a slow source or the LLM.
+                    done, _ = wait(pending, timeout=self.config.db_flush_interval, return_when=FIRST_COMPLETED)
+                    self.data_manager.flush_if_due()
+                    for future in done:
+                        work = pending.pop(future)
+                        if isinstance(work, list):
+                            for (index, current_data, prior_data, prior_is_new, page_state), insights in zip(work, future.result()):
+                                finish(index, current_data, prior_data, prior_is_new, insights, page_state)
+                            continue
+
+                        current_data, prior_data, prior_is_new, insights, page_state = future.result()
+                        if insights is None:
+                            llm_queue.append((work, current_data, prior_data, prior_is_new, page_state))
+                        else:
+                            finish(work, current_data, prior_data, prior_is_new, insights, page_state)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        return [result for result in results if result is not None]
+
+    def _process_url(self, url: str, prior_data: Dict[str, Any], page_state: Optional[Dict[str, Any]] = None,
+                     lastmod: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, Any], bool, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Extract data and generate insights for a URL. Runs on a worker thread.
+
+        With skip_unchanged_pages, the page is first revalidated against `page_state`
+        and its sitemap `lastmod`, and if it hasn't changed, the prior period's URLExtractor payload is reused
+        instead of scraping it again. The new page state is returned for the caller to store.
+        With prescreen_enabled, the LLM is only asked for insights when some metric changed significantly.
+        With llm_batch_size above 1, insights are None when they are left to a batch.
+        """
+        logger.info(f"Processing {url}")
+        reuse = None
+        if self.config.skip_unchanged_pages:
+            unchanged, page_state = self.data_manager.revalidate_page(url, page_state, lastmod)
+            previous_page = prior_data.get('data', {}).get('URLExtractor') if prior_data else None
+            if unchanged and previous_page and previous_page.get('clean_content'):
+                reuse = {'URLExtractor': previous_page}
+        current_data = self.data_manager.get_current_data_live(url, reuse=reuse)
+
+        # A stored prior period with failed sources is extracted again rather than reused.
+        prior_is_new = not prior_data or bool(self.data_manager.failed_sources(prior_data))
+        if prior_is_new:
+            prior_data = self.data_manager.get_prior_data_live(url)
+
+        if self.config.prescreen_enabled and self.change_detector.significant_changes(current_data, prior_data) == []:
+            logger.info(f"No material change for {url}, skipping insights")
+            insights = self.llm_manager.no_change_insights()
+        elif self.config.llm_batch_size > 1:
+            insights = None
+        else:
+            try:
+                insights = self.llm_manager.generate_structured_insights(current_data, prior_data)
+            except TokenBudgetExceeded as e:
+                logger.warning(f"Skipping insights for {url}: {e}")
+                insights = self.llm_manager.skipped_insights('token_budget_exceeded')
+            except (GeminiAPIError, ValueError) as e:
+                # One URL's failed or malformed response shouldn't abort the run.
+                logger.error(f"Error generating insights for {url}: {e}")
+                insights = self.llm_manager.skipped_insights('generation_failed')
+        return current_data, prior_data, prior_is_new, insights, page_state
+
+    def _generate_batch(self, items: List[Tuple]) -> List[Dict[str, Any]]:
+        """Generate insights for queued URLs in batches. Runs on a worker thread."""
+        return self.llm_manager.generate_batch_insights([(current, prior) for _, current, prior, _, _ in items])
+
+    def _get_urls(self) -> Iterator[SitemapEntry]:
         if self.config.sitemap_urls:
             logger.info("Using sitemap URLs from configuration.")
-            return self.config.sitemap_urls
+            return (SitemapEntry(url) for url in self.config.sitemap_urls)
         logger.info("Using sitemap file.")
-        return self.extract_urls_from_sitemap(self.config.sitemap_file)
+        reader = SitemapReader(max_workers=self.config.sitemap_workers, timeout=self.config.fetch_timeout)
+        return reader.iter_entries(self.config.sitemap_file)
 
     @staticmethod
     def extract_urls_from_sitemap(sitemap_source: str) -> List[str]:
-        urls = []
-        try:
-            if sitemap_source.startswith(('http://', 'https://')):
-                # Fetch sitemap from URL
-                response = requests.get(sitemap_source)
-                response.raise_for_status()  # Raise an exception for bad status codes
-                root = ET.fromstring(response.content)
-            else:
-                # Parse local file
-                tree = ET.parse(sitemap_source)
-                root = tree.getroot()
-
-            namespace = {'sitemap': 'http://www.sitemaps.org/schemas/sitemap/0.9'}
-            for url in root.findall('sitemap:url', namespace):
-                loc = url.find('sitemap:loc', namespace)
-                if loc is not None:
-                    urls.append(loc.text)
-        except requests.RequestException as e:
-            logger.error(f"Error fetching sitemap from URL: {e}")
-        except ET.ParseError as e:
-            logger.error(f"Error parsing sitemap: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-        return urls
\ No newline at end of file
+        return [entry.loc for entry in SitemapReader().iter_entries(sitemap_source)]
@@ -0,0 +1,179 @@
+"""Streaming sitemap reader for the SEO Data Platform."""
+
+import gzip
+import io
+import queue
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+from loguru import logger
+
+# Entries buffered between the sitemap workers and the consumer.
+ENTRY_QUEUE_SIZE = 1000
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class SitemapEntry(NamedTuple):
+    loc: str
+    lastmod: Optional[str] = None
+
+
+class _ChildSitemap(NamedTuple):
+    """A <sitemap> entry of a sitemap index, handed back to the consumer to schedule."""
+    loc: str
+
+
+class _Cancelled(Exception):
+    """Raised in a worker when the consumer stopped reading."""
+
+
+_DONE = object()
+
+
+def _local_name(tag: str) -> str:
+    """Strip the namespace from an element tag."""
+    return tag.rsplit('}', 1)[-1]
+
+
+class SitemapReader:
+    """
+    Reads sitemaps and sitemap indexes incrementally.
+
+    Documents are parsed with iterparse as they are downloaded and every entry
+    is discarded once it has been handed on, so memory use doesn't depend on
+    the size of the sitemap. Child sitemaps of an index are fetched at the same
+    time on a pool of `max_workers` threads sharing one keep-alive session, and
+    gzipped sitemaps are decompressed on the fly.
+    """
+
+    def __init__(self, max_workers: int = 8, timeout: float = 30):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = DEFAULT_ACCEPT_ENCODING
+
+    def iter_entries(self, source: str) -> Iterator[SitemapEntry]:
+        """
+        Yield the (loc, lastmod) entries of a sitemap, following sitemap indexes.
+
+        Args:
+            source (str): A sitemap URL or local file path.
+
+        Yields:
+            SitemapEntry: The page entries, in no particular order across child sitemaps.
+        """
+        entries = queue.Queue(maxsize=ENTRY_QUEUE_SIZE)
+        stop = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sitemap')
+        seen = {source}
+        pending = 1
+        executor.submit(self._read, source, entries, stop)
+
+        try:
+            while pending:
+                item = entries.get()
+                if item is _DONE:
+                    pending -= 1
+                elif isinstance(item, _ChildSitemap):
+                    if item.loc not in seen:
+                        seen.add(item.loc)
+                        pending += 1
+                        executor.submit(self._read, item.loc, entries, stop)
+                else:
+                    yield item
+        finally:
+            # Unblocks workers waiting on a full queue if the consumer stopped early.
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def _read(self, source: str, entries: queue.Queue, stop: threading.Event) -> None:
+        """Parse one sitemap document, putting its entries on the queue. Runs on the sitemap pool."""
+        count = 0
+        try:
+            with self._open(source) as stream:
+                for item in self._parse(stream):
+                    self._put(entries, item, stop)
+                    count += 1
+            logger.info(f"Read {count} entries from sitemap {source}")
+        except _Cancelled:
+            pass
+        except requests.RequestException as e:
+            logger.error(f"Error fetching sitemap from URL {source}: {e}")
+        except (ET.ParseError, OSError, EOFError) as e:
+            logger.error(f"Error parsing sitemap {source}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error reading sitemap {source}: {e}")
+        finally:
+            try:
+                self._put(entries, _DONE, stop)
+            except _Cancelled:
+                pass
+
+    @contextmanager
+    def _open(self, source: str) -> Iterator[BinaryIO]:
+        """Open a sitemap URL or file as a byte stream, transparently gunzipping it."""
+        if source.startswith(('http://', 'https://')):
+            with self.session.get(source, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                # Undo Content-Encoding while streaming; .xml.gz payloads are handled below.
+                response.raw.decode_content = True
+                # Let BufferedReader see EOF instead of a closed stream at the end of the body.
+                response.raw.auto_close = False
+                yield self._decompress(io.BufferedReader(response.raw))
+        else:
+            with open(source, 'rb') as f:
+                yield self._decompress(io.BufferedReader(f))
+
+    @staticmethod
+    def _decompress(stream: io.BufferedReader) -> BinaryIO:
+        if stream.peek(2)[:2] == GZIP_MAGIC:
+            return gzip.GzipFile(fileobj=stream)
+        return stream
+
+    @staticmethod
+    def _parse(stream: BinaryIO) -> Iterator[NamedTuple]:
+        """Yield SitemapEntry for <url> and _ChildSitemap for <sitemap> elements."""
+        context = ET.iterparse(stream, events=('start', 'end'))
+        _, root = next(context)
+
+        for event, element in context:
+            if event != 'end':
+                continue
+            tag = _local_name(element.tag)
+            if tag not in ('url', 'sitemap'):
+                continue
+
+            loc = lastmod = None
+            for child in element:
+                name = _local_name(child.tag)
+                if name == 'loc':
+                    loc = (child.text or '').strip()
+                elif name == 'lastmod':
+                    lastmod = (child.text or '').strip() or None
+            # Drop the entries parsed so far to keep memory flat.
+            root.clear()
+
+            if not loc:
+                continue
+            yield _ChildSitemap(loc) if tag == 'sitemap' else SitemapEntry(loc, lastmod)
+
+    @staticmethod
+    def _put(entries: queue.Queue, item, stop: threading.Event) -> None:
+        while True:
+            if stop.is_set():
+                raise _Cancelled()
+            try:
+                entries.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
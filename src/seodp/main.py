@@ -1,17 +1,27 @@
 """Main module to handle command-line arguments and initiate the SEO Data Platform."""
 
 import argparse
+import atexit
 import os
-from apscheduler.schedulers.blocking import BlockingScheduler
+import sys
+from lib.exceptions import ConfigurationError
 from lib.manager import Manager
 from lib import logconfig
-from settings import CONFIG
+from settings import SERVICE_CREDENTIALS, get_config
 from loguru import logger
 
+# The services each command uses, whose credentials are checked before it starts.
+COMMAND_SERVICES = {
+    'start': ('extractors', 'gemini', 'email'),
+    'url_test': ('extractors', 'gemini'),
+    'sitemap_test': ('extractors', 'gemini'),
+    'email_test': ('email',),
+    'compact_db': (),
+}
 
-def start_scheduled_run():
+
+def start_scheduled_run(manager: Manager):
     """Start the scheduled SEO data processing."""
-    manager = Manager(CONFIG)
     manager.run_schedule()
 
 
@@ -26,6 +36,8 @@ def main():
     parser.add_argument('--sitemap_test', action='store_true', help='Run the example sitemap URLs and save results to a file')
     parser.add_argument('--email_test', action='store_true', help='Run the example sitemap URLs and email the results')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--no-cache', action='store_true', help='Bypass the on-disk API and LLM response caches')
+    parser.add_argument('--compact_db', action='store_true', help='Recompress all stored data and shrink the database file')
     args = parser.parse_args()
 
     if args.debug:
@@ -33,7 +45,25 @@ def main():
     else:
         logger.level('INFO')
 
-    manager = Manager(CONFIG)
+    if not (args.start or args.url_test or args.sitemap_test or args.email_test or args.compact_db):
+        parser.print_help()
+        return
+
+    # Services and their dependencies are only loaded once a command needs them.
+    config = get_config()
+    if args.no_cache:
+        config = config.model_copy(update={'cache_enabled': False})
+
+    # Credentials are checked lazily by each service, so check the ones this command
+    # needs before any work starts rather than failing partway through a run.
+    command = next(name for name in COMMAND_SERVICES if getattr(args, name))
+    try:
+        config.api.require(*[field for service in COMMAND_SERVICES[command] for field in SERVICE_CREDENTIALS[service]])
+    except ConfigurationError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    manager = Manager(config)
+    atexit.register(manager.context.close)
 
     results = None  # Initialize results
 
@@ -43,11 +73,13 @@ def main():
             logger.error("Invalid SCHEDULE value. Must be 'weekly' or 'monthly'.")
             return
 
+        from apscheduler.schedulers.blocking import BlockingScheduler
+
         scheduler = BlockingScheduler()
         if schedule == 'weekly':
-            scheduler.add_job(start_scheduled_run, 'cron', day_of_week='mon', hour=0, minute=0)
+            scheduler.add_job(start_scheduled_run, 'cron', args=[manager], day_of_week='mon', hour=0, minute=0)
         else:  # monthly
-            scheduler.add_job(start_scheduled_run, 'cron', day=1, hour=0, minute=0)
+            scheduler.add_job(start_scheduled_run, 'cron', args=[manager], day=1, hour=0, minute=0)
 
         try:
             scheduler.start()
@@ -60,8 +92,8 @@ def main():
         else:
             logger.error(f"Error running URL test for {args.url_test}")
     elif args.sitemap_test:
-        if CONFIG.test_sitemap_urls:
-            results = manager.run_sitemap_test(CONFIG.test_sitemap_urls)
+        if config.test_sitemap_urls:
+            results = manager.run_sitemap_test(config.test_sitemap_urls)
             logger.info("Sitemap test completed")
         else:
             logger.error("No sitemap URLs provided for testing.")
@@ -72,8 +104,8 @@ def main():
             return
         manager.run_email_test(recipient_email)
         logger.info("Email test completed")
-    else:
-        parser.print_help()
+    elif args.compact_db:
+        manager.data_manager.compact_database()
 
     if args.output and results is not None:  # Check if results is defined
         manager.save_results(results, args.output)
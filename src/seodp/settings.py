@@ -1,7 +1,8 @@
 """Settings for the SEO Data Platform."""
 
+from functools import lru_cache
 from pathlib import Path
-from typing import Type, Tuple, List, Optional
+from typing import Type, Tuple, List, Optional, Dict, Literal
 
 import pydantic
 from pydantic_settings import (
@@ -12,23 +13,51 @@ from pydantic_settings import (
 )
 from typing_extensions import Self
 
+from lib.exceptions import ConfigurationError
+
 
 class APIConfig(BaseSettings):
     """Configuration settings for external APIs."""
 
     model_config = SettingsConfigDict(env_file=".env", extra="ignore", frozen=True)
 
-    service_account_file: pydantic.FilePath = pydantic.Field(validation_alias="service_account_file_path")
-    subject_email: pydantic.EmailStr
-    scrapingbee_api_key: str
-    gemini_api_key: str
-    psi_api_key: str
-    mailtrap_login: str
-    mailtrap_password: str
-    mailtrap_sender_email: pydantic.EmailStr
-    recipient_email: pydantic.EmailStr
+    # Credentials are optional here so that commands which don't use a service can
+    # run without its keys. Code that needs them calls `require` first.
+    service_account_file: Optional[pydantic.FilePath] = pydantic.Field(None, validation_alias="service_account_file_path")
+    subject_email: Optional[pydantic.EmailStr] = None
+    scrapingbee_api_key: Optional[str] = None
+    gemini_api_key: Optional[str] = None
+    psi_api_key: Optional[str] = None
+    mailtrap_login: Optional[str] = None
+    mailtrap_password: Optional[str] = None
+    mailtrap_sender_email: Optional[pydantic.EmailStr] = None
+    recipient_email: Optional[pydantic.EmailStr] = None
     psi_timeout: pydantic.PositiveInt = 60
 
+    def require(self, *fields: str) -> None:
+        """Raise a ConfigurationError naming any of the given settings that are not set."""
+        missing = [field for field in fields if not getattr(self, field)]
+        if missing:
+            raise ConfigurationError(f"Missing API settings: {', '.join(missing)}. Check your .env file.")
+
+
+# The API settings each group of services needs, checked up front by main.py.
+SERVICE_CREDENTIALS = {
+    'extractors': ('service_account_file', 'subject_email', 'psi_api_key', 'scrapingbee_api_key'),
+    'gemini': ('gemini_api_key',),
+    'email': ('mailtrap_login', 'mailtrap_password', 'mailtrap_sender_email', 'recipient_email'),
+}
+
+
+class MetricThreshold(pydantic.BaseModel):
+    """When a change in a metric counts as significant. Every bound that is set must be met."""
+
+    model_config = pydantic.ConfigDict(frozen=True)
+
+    absolute: Optional[pydantic.NonNegativeFloat] = None
+    # Percentage of the prior value
+    relative: Optional[pydantic.NonNegativeFloat] = None
+
 
 class Config(BaseSettings):
     """Configuration settings for the SEO Data Platform."""
@@ -38,12 +67,46 @@ class Config(BaseSettings):
     api: APIConfig
 
     db_file: Path
+    db_batch_size: pydantic.PositiveInt = 100
+    db_flush_interval: pydantic.PositiveInt = 30
+    db_compression: Literal['zstd', 'zlib', 'none'] = 'zstd'
+    cache_enabled: bool = True
+    cache_dir: Path = Path('.seodp_cache')
+    cache_max_mb: pydantic.PositiveInt = 512
+    cache_open_period_ttl: pydantic.NonNegativeInt = 3600
+    cache_settle_days: pydantic.NonNegativeInt = 3
+    cache_extractors: List[str] = ['GA4Extractor', 'GSCExtractor', 'PSIExtractor']
+    llm_cache_max_mb: pydantic.PositiveInt = 64
     gemini_model: str = 'gemini-1.5-pro'
+    gemini_input_cost_per_million: pydantic.NonNegativeFloat = 1.25
+    gemini_output_cost_per_million: pydantic.NonNegativeFloat = 5.0
+    llm_run_token_budget: Optional[pydantic.PositiveInt] = None
+    llm_fallback_model: Optional[str] = None
+    llm_batch_size: pydantic.PositiveInt = 1
+    llm_batch_token_budget: pydantic.PositiveInt = 24000
     low_traffic_threshold: pydantic.NonNegativeInt = 100
+    max_concurrency: pydantic.PositiveInt = 1
+    extractor_timeout: pydantic.PositiveInt = 180
+    extractor_timeouts: Dict[str, pydantic.PositiveInt] = {}
+    content_extraction: Literal['readability', 'local'] = 'readability'
+    content_workers: pydantic.PositiveInt = 2
+    content_timeout: pydantic.PositiveInt = 60
+    fetch_strategy: Literal['browser', 'auto'] = 'browser'
+    fetch_timeout: pydantic.PositiveInt = 15
+    render_min_word_count: pydantic.NonNegativeInt = 100
+    skip_unchanged_pages: bool = False
     schedule: str = 'monthly'
     site_url: str
     property_id: str
+    ga4_site_wide: bool = False
+    gsc_bulk: bool = False
     sitemap_file: Optional[str] = None
+    sitemap_workers: pydantic.PositiveInt = 8
+    canonicalize_urls: bool = True
+    canonical_https: bool = True
+    canonical_ignore_trailing_slash: bool = True
+    canonical_lowercase_path: bool = False
+    canonical_ignore_params: List[str] = ['utm_*', 'gclid', 'gbraid', 'wbraid', 'fbclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl']
     sitemap_urls: Optional[List[str]] = None
     test_sitemap_urls: Optional[List[str]] = None
     report_email_subject: str = 'SEO Insights Report'
@@ -59,6 +122,25 @@ class Config(BaseSettings):
         'Causal relationships between changes'
     ]
     max_insights: pydantic.NonNegativeInt = 5
+    compact_prompts: bool = True
+    prompt_token_budget: pydantic.PositiveInt = 6000
+    prompt_content_diff_chars: pydantic.NonNegativeInt = 3000
+    prescreen_enabled: bool = True
+    prescreen_thresholds: Dict[str, MetricThreshold] = {
+        'GA4Extractor.organic_sessions': MetricThreshold(absolute=25, relative=10),
+        'GA4Extractor.organic_users': MetricThreshold(absolute=25, relative=10),
+        'GA4Extractor.engagement_rate': MetricThreshold(absolute=0.05),
+        'GA4Extractor.bounce_rate': MetricThreshold(absolute=0.05),
+        'GA4Extractor.revenue': MetricThreshold(absolute=100, relative=10),
+        'GSCExtractor.clicks': MetricThreshold(absolute=25, relative=10),
+        'GSCExtractor.impressions': MetricThreshold(absolute=250, relative=10),
+        'GSCExtractor.ctr': MetricThreshold(absolute=0.01, relative=10),
+        'GSCExtractor.avg_position': MetricThreshold(absolute=1),
+        'PSIExtractor.mobile.performance_score': MetricThreshold(absolute=0.1),
+        'PSIExtractor.desktop.performance_score': MetricThreshold(absolute=0.1),
+        'URLExtractor.word_count': MetricThreshold(absolute=50, relative=10),
+    }
+    prescreen_watch_fields: List[str] = ['URLExtractor.metadata.title', 'URLExtractor.metadata.description']
 
     @pydantic.model_validator(mode="after")
     def check_sitemap_file_or_urls(self) -> Self:
@@ -67,6 +149,13 @@ class Config(BaseSettings):
             raise ValueError("No sitemap URLs or file provided in configuration.")
         return self
 
+    @pydantic.model_validator(mode="after")
+    def check_batching_uses_compact_prompts(self) -> Self:
+        """Batch prompts are built from compacted data, so batching requires compact prompts."""
+        if self.llm_batch_size > 1 and not self.compact_prompts:
+            raise ValueError("llm_batch_size above 1 requires compact_prompts.")
+        return self
+
     @classmethod
     def settings_customise_sources(
         cls,
@@ -87,5 +176,17 @@ class Config(BaseSettings):
         )
 
 
-API_CONFIG = APIConfig()
-CONFIG = Config(api=API_CONFIG)
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """Load the configuration on first use and return the same instance afterwards."""
+    return Config(api=APIConfig())
+
+
+def __getattr__(name: str):
+    # Keep `from settings import CONFIG` working without loading the configuration at import time.
+    if name == "CONFIG":
+        return get_config()
+    if name == "API_CONFIG":
+        return get_config().api
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+